@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- encoding: UTF8 -*-
+
+# This file is part of PfeifferVacuum.py.
+#
+# PfeifferVacuum.py is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PfeifferVacuum.py is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PfeifferVacuum.py. If not, see <http://www.gnu.org/licenses/>.
+
+
+### An asyncio version of PfeifferVacuum.MaxiGauge (Python 3.7+, Unix only).
+### PySerial is only used to open and configure the port, all I/O happens
+### on its non-blocking file descriptor from within the event loop.
+### Commands of concurrent tasks are serialized per device, so one event
+### loop can drive many MaxiGauge controllers:
+###
+###   async with AsyncMaxiGauge('/dev/ttyUSB0') as mg:
+###       print(await mg.pressures())
+
+import os
+import time
+import asyncio
+
+import serial
+
+from PfeifferVacuum import PressureReading, MaxiGaugeError, MaxiGaugeNAK, MaxiGaugeTimeout, C, LINE_TERMINATION, ERR_CODES
+
+class AsyncMaxiGauge(object):
+    def __init__(self, serialPort, baud=9600, timeout=1., debug=False, reprobe_interval=30.):
+        self.debug = debug
+        self.timeout = timeout
+        self.reprobe_interval = reprobe_interval
+        self.latest_readings = [None] * 6
+        self.skip_until = [0.] * 6
+        try:
+            self.connection = serial.Serial(serialPort, baudrate=baud, timeout=0, write_timeout=0)
+        except serial.serialutil.SerialException as se:
+            raise MaxiGaugeError(se)
+        self.fd = self.connection.fileno()
+        self.terminator = LINE_TERMINATION.encode('latin-1')
+        self.buffer = bytearray()
+        self.frames = None
+        self.lock = None
+        self.loop = None
+        self.interrupted = False
+
+    async def __aenter__(self):
+        self.attach()
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    def attach(self):
+        ''' Start watching the serial port on the running event loop '''
+        if self.loop is not None: return
+        self.loop = asyncio.get_running_loop()
+        self.frames = asyncio.Queue()
+        self.lock = asyncio.Lock()
+        self.loop.add_reader(self.fd, self.data_received)
+
+    def close(self):
+        if self.loop is not None:
+            self.loop.remove_reader(self.fd)
+            self.loop = None
+        if self.connection: self.connection.close()
+        self.connection = None
+
+    def data_received(self):
+        try:
+            data = os.read(self.fd, 1024)
+        except (BlockingIOError, InterruptedError):
+            return
+        self.debugMessage(data)
+        self.buffer += data
+        while True:
+            end = self.buffer.find(self.terminator)
+            if end < 0: break
+            self.frames.put_nowait(bytes(self.buffer[:end]).decode('latin-1'))
+            del self.buffer[:end+len(self.terminator)]
+
+    def discard_input(self):
+        del self.buffer[:]
+        while not self.frames.empty():
+            self.frames.get_nowait()
+
+    def debugMessage(self, message):
+        if self.debug: print(repr(message))
+
+    async def checkDevice(self):
+        message = "The Display Contrast is currently set to %d (out of 20).\n" % await self.displayContrast()
+        message += "Keys since MaxiGauge was switched on: %s (out of 1,2,3,4,5).\n" % ", ".join( map (str, await self.pressedKeys()) )
+        return message
+
+    async def pressedKeys(self):
+        keys = int((await self.send('TKB',1))[0])
+        return [i+1 for i in range(5) if keys & 2**i] # It's got 5 keys
+
+    async def displayContrast(self, newContrast=-1):
+        if newContrast == -1: return int((await self.send('DCC',1))[0])
+        else: return int((await self.send('DCC,%d' % (newContrast,) ,1))[0])
+
+    async def pressures(self):
+        now = time.time()
+        return [self.latest_readings[i] if now < self.skip_until[i] else await self.pressure(i+1) for i in range(6)]
+
+    async def pressure(self, sensor):
+        if sensor < 1 or sensor >6: raise MaxiGaugeError('Sensor can only be between 1 and 6. You choose ' + str(sensor))
+        reading = await self.send('PR%d' % sensor, 1)  ## reading will have the form x,x.xxxEsx <CR><LF> (see p.88)
+        try:
+            r = reading[0].split(',')
+            status = int(r[0])
+            pressure = float(r[-1])
+        except:
+            raise MaxiGaugeError("Problem interpreting the returned line:\n%s" % reading)
+        reading = PressureReading(sensor, status, pressure)
+        self.latest_readings[sensor-1] = reading
+        if status in [4,5]: self.skip_until[sensor-1] = time.time() + self.reprobe_interval
+        else: self.skip_until[sensor-1] = 0.
+        return reading
+
+    async def continuous_pressures(self, update_time):
+        ''' Yields the pressures every update_time seconds (without drifting) '''
+        next_time = time.monotonic()
+        while True:
+            yield await self.pressures()
+            next_time = max(next_time + update_time, time.monotonic())
+            await asyncio.sleep(next_time - time.monotonic())
+
+    async def send(self, mnemonic, numEnquiries = 0, timeout = None):
+        ''' Sends a command and returns the responses of numEnquiries enquiries.
+Raises MaxiGaugeTimeout if the whole transaction takes longer than timeout. '''
+        self.attach()
+        if timeout is None: timeout = self.timeout
+        async with self.lock:
+            try:
+                return await asyncio.wait_for(self.transaction(mnemonic, numEnquiries), timeout)
+            except asyncio.TimeoutError:
+                # late answers must not end up in the next transaction
+                self.interrupted = True
+                raise MaxiGaugeTimeout('No complete answer to %s within %.2f s' % (mnemonic, timeout))
+            except asyncio.CancelledError:
+                self.interrupted = True
+                raise
+
+    async def transaction(self, mnemonic, numEnquiries):
+        if self.interrupted:
+            await self.write(C['ETX'])
+            await asyncio.sleep(0.05)
+            self.interrupted = False
+        self.discard_input()
+        await self.write(mnemonic+LINE_TERMINATION)
+        await self.getACQorNAK()
+        response = []
+        for i in range(numEnquiries):
+            await self.enquire()
+            response.append(await self.read())
+        return response
+
+    async def write(self, what):
+        self.debugMessage(what)
+        data = memoryview(what.encode('latin-1'))
+        while data:
+            try:
+                data = data[os.write(self.fd, data):]
+            except BlockingIOError:
+                writable = self.loop.create_future()
+                self.loop.add_writer(self.fd, lambda: writable.done() or writable.set_result(None))
+                try:
+                    await writable
+                finally:
+                    self.loop.remove_writer(self.fd)
+
+    async def enquire(self):
+        await self.write(C['ENQ'])
+
+    async def read(self):
+        return await self.frames.get()
+
+    async def getACQorNAK(self):
+        returncode = await self.read()
+        if len(returncode)<1: self.debugMessage('Only received a line termination from MaxiGauge. Was expecting ACQ or NAK.')
+        if len(returncode)>0 and returncode[-1] == C['NAK']:
+            await self.enquire()
+            returnedError = await self.read()
+            error = str(returnedError).split(',' , 1)
+            self.debugMessage(error)
+            try:
+                errmsg = { 'System Error': ERR_CODES[0][int(error[0])] , 'Gauge Error': ERR_CODES[1][int(error[1])] }
+            except:
+                raise MaxiGaugeError("Problem interpreting the returned error status:\n%s" % returnedError)
+            raise MaxiGaugeNAK(errmsg)
+        if len(returncode)>0 and returncode[-1] != C['ACQ']: self.debugMessage('Expecting ACQ or NAK from MaxiGauge but neither were sent.')
+        return returncode[:-1]
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- encoding: UTF8 -*-
+
+# This file is part of PfeifferVacuum.py.
+#
+# PfeifferVacuum.py is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PfeifferVacuum.py is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PfeifferVacuum.py. If not, see <http://www.gnu.org/licenses/>.
+
+
+### Polls several MaxiGauge controllers at the same time.
+### Every controller gets its own thread (the serial I/O releases the GIL)
+### and all of them follow one fixed rate schedule. The timestamped samples
+### are handed to a single sink callable from one dispatcher thread, so the
+### sink never has to care about concurrency.
+
+import time
+import math
+import threading
+from collections import namedtuple
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from PfeifferVacuum import MaxiGauge, MaxiGaugeError
+
+Sample = namedtuple('Sample', ['controller', 'time', 'readings'])
+
+class AcquisitionEngine(object):
+    ''' Polls a dict of {name: MaxiGauge} every `period` seconds and
+calls `sink(sample)` for every Sample acquired. '''
+    def __init__(self, controllers, period=1., sink=None):
+        self.controllers = controllers
+        self.period = period
+        self.sink = sink if sink else print_sample
+        self.samples = queue.Queue()
+        self.stopping = threading.Event()
+        self.errors = dict((name, 0) for name in controllers)
+        self.missed_ticks = dict((name, 0) for name in controllers)
+        self.threads = []
+
+    def start(self):
+        self.stopping.clear()
+        # start on a full period, so all controllers share the same ticks
+        self.start_time = math.ceil(time.time() / self.period) * self.period
+        self.threads = [threading.Thread(target=self.poll, args=(name, mg)) for name, mg in self.controllers.items()]
+        self.threads.append(threading.Thread(target=self.dispatch))
+        for t in self.threads:
+            t.daemon = True
+            t.start()
+
+    def stop(self):
+        self.stopping.set()
+        for t in self.threads:
+            t.join()
+        self.threads = []
+
+    def poll(self, name, mg):
+        tick = 0
+        while not self.stopping.is_set():
+            deadline = self.start_time + tick * self.period
+            if self.stopping.wait(max(0., deadline - time.time())): break
+            now = time.time()
+            try:
+                self.samples.put(Sample(name, now, mg.pressures()))
+            except MaxiGaugeError:
+                self.errors[name] += 1
+            # if the controller could not keep up, continue with the next tick to come
+            next_tick = int((time.time() - self.start_time) / self.period) + 1
+            self.missed_ticks[name] += max(0, next_tick - tick - 1)
+            tick = max(tick + 1, next_tick)
+
+    def dispatch(self):
+        while not self.stopping.is_set() or not self.samples.empty():
+            try:
+                sample = self.samples.get(timeout=.2)
+            except queue.Empty:
+                continue
+            self.sink(sample)
+
+def format_sample(sample):
+    ''' Formats a sample like the lines of measurement-data.txt '''
+    return "%d, " % sample.time + ', '.join(["%.3E" % sensor.pressure if sensor.status in [0,1,2] else '' for sensor in sample.readings])
+
+def print_sample(sample):
+    print("%s: %s" % (sample.controller, format_sample(sample)))
+
+class LogfileSink(object):
+    ''' Appends the samples of every controller to its own log file
+named after `pattern` (e.g. measurement-data-%s.txt). '''
+    def __init__(self, pattern='measurement-data-%s.txt', flush=True):
+        self.pattern = pattern
+        self.flush = flush
+        self.logfiles = {}
+
+    def __call__(self, sample):
+        if sample.controller not in self.logfiles:
+            self.logfiles[sample.controller] = open(self.pattern % sample.controller, 'a')
+        logfile = self.logfiles[sample.controller]
+        logfile.write(format_sample(sample) + '\n')
+        if self.flush: logfile.flush()
+
+    def close(self):
+        for logfile in self.logfiles.values():
+            logfile.close()
@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+# -*- encoding: UTF8 -*-
+
+# This file is part of PfeifferVacuum.py.
+#
+# PfeifferVacuum.py is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PfeifferVacuum.py is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PfeifferVacuum.py. If not, see <http://www.gnu.org/licenses/>.
+
+
+### Shares one MaxiGauge between several local processes.
+### The broker (see maxigauge-broker.py) owns the serial port and accepts
+### commands over a Unix socket. A single thread sends them to the device
+### one after the other, so the transactions of different clients never
+### interleave. Identical pressure reads (PR1 ... PR6) that are queued or
+### under way are answered by one round-trip to the device.
+###
+###   ./maxigauge-broker.py /dev/ttyUSB0
+###
+### MaxiGaugeClient is a MaxiGauge talking to the broker instead of the
+### serial port. It also takes the name of the serial port, so switching
+### a script over only takes a different import:
+###
+###   from MaxiGaugeBroker import MaxiGaugeClient as MaxiGauge
+###   mg = MaxiGauge('/dev/ttyUSB0')
+###
+### One JSON object per line goes each way:
+###
+###   {"command": "PR1", "enquiries": 1}
+###   {"response": ["0,1.0000E-06"]}   or   {"error": "MaxiGaugeNAK", "message": ...}
+
+import os
+import re
+import stat
+import json
+import socket
+import tempfile
+import threading
+try:
+    import queue
+    import socketserver
+except ImportError:
+    import Queue as queue
+    import SocketServer as socketserver
+
+from PfeifferVacuum import MaxiGauge, MaxiGaugeError, MaxiGaugeNAK, MaxiGaugeTimeout, FrameReader
+
+## Commands only reading a value, the clients asking for the same one at the same time share the answer
+COALESCED = re.compile(r'^PR[1-6]$')
+
+ERRORS = dict((error.__name__, error) for error in (MaxiGaugeError, MaxiGaugeNAK, MaxiGaugeTimeout))
+
+def socket_path(port):
+    ''' The socket of the broker for a serial port: '/dev/ttyUSB0' -> '/tmp/maxigauge-ttyUSB0.sock' '''
+    return os.path.join(tempfile.gettempdir(), 'maxigauge-%s.sock' % os.path.basename(port))
+
+def is_socket(path):
+    try:
+        return stat.S_ISSOCK(os.stat(path).st_mode)
+    except OSError:
+        return False
+
+class PendingCommand(object):
+    ''' A command waiting for (or being sent to) the device, shared by `clients` requests '''
+    def __init__(self, mnemonic, enquiries):
+        self.mnemonic = mnemonic
+        self.enquiries = enquiries
+        self.clients = 1
+        self.response = None
+        self.error = None
+        self.done = threading.Event()
+
+class MaxiGaugeBroker(object):
+    def __init__(self, maxigauge, path):
+        self.maxigauge = maxigauge
+        self.path = path
+        self.queue = queue.Queue()
+        self.in_flight = {} # (mnemonic, enquiries) -> PendingCommand of the coalesced commands
+        self.lock = threading.Lock()
+        self.server = None
+        self.requests = 0
+        self.transactions = 0
+        self.coalesced = 0
+
+    def submit(self, mnemonic, enquiries):
+        ''' Queues a command (or joins the identical one in flight) and waits for it to be done '''
+        key = (mnemonic, enquiries)
+        with self.lock:
+            self.requests += 1
+            pending = self.in_flight.get(key)
+            if pending is not None:
+                pending.clients += 1
+                self.coalesced += 1
+            else:
+                pending = PendingCommand(mnemonic, enquiries)
+                if COALESCED.match(mnemonic): self.in_flight[key] = pending
+                self.queue.put(pending)
+        pending.done.wait()
+        return pending
+
+    def process_commands(self):
+        ''' Sends the queued commands to the device, one at a time '''
+        while True:
+            pending = self.queue.get()
+            if pending is None: break
+            try:
+                pending.response = self.maxigauge.send(pending.mnemonic, pending.enquiries)
+            except MaxiGaugeError as e:
+                pending.error = e
+            except Exception as e: # e.g. the serial port is gone
+                pending.error = MaxiGaugeError(str(e))
+            with self.lock:
+                self.transactions += 1
+                key = (pending.mnemonic, pending.enquiries)
+                if self.in_flight.get(key) is pending: del self.in_flight[key]
+            pending.done.set()
+
+    def answer(self, request):
+        ''' The reply to one decoded request line '''
+        try:
+            mnemonic = str(request['command'])
+            enquiries = int(request.get('enquiries', 0))
+        except (KeyError, TypeError, ValueError, AttributeError):
+            return {'error': 'MaxiGaugeError', 'message': 'Malformed request: %r' % (request,)}
+        if '\r' in mnemonic or '\n' in mnemonic or not 0 <= enquiries <= 10:
+            return {'error': 'MaxiGaugeError', 'message': 'Refusing to send %r with %d enquiries' % (mnemonic, enquiries)}
+        pending = self.submit(mnemonic, enquiries)
+        if pending.error is None: return {'response': pending.response}
+        error = pending.error
+        name = type(error).__name__ if type(error).__name__ in ERRORS else 'MaxiGaugeError'
+        # a NAK carries the decoded error status as dict
+        message = error.args[0] if isinstance(error, MaxiGaugeNAK) and error.args else str(error)
+        return {'error': name, 'message': message}
+
+    def start(self):
+        ''' Listens on the socket and starts the threads serving the clients and the device '''
+        if is_socket(self.path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+            except socket.error:
+                os.unlink(self.path) # left behind by a broker that is gone
+            else:
+                raise MaxiGaugeError('Another broker is already listening on %s' % self.path)
+            finally:
+                probe.close()
+        self.server = BrokerServer(self.path, BrokerRequestHandler)
+        self.server.broker = self
+        for target in (self.process_commands, self.server.serve_forever):
+            t = threading.Thread(target=target)
+            t.daemon = True
+            t.start()
+
+    def close(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+        self.queue.put(None)
+
+    def statistics(self):
+        with self.lock:
+            return {'requests': self.requests, 'transactions': self.transactions, 'coalesced': self.coalesced, 'queued': self.queue.qsize()}
+
+class BrokerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 64 # clients connecting at the same time
+
+class BrokerRequestHandler(socketserver.StreamRequestHandler):
+    ''' Answers the request lines of one client connection '''
+    def handle(self):
+        broker = self.server.broker
+        for line in iter(self.rfile.readline, b''):
+            try:
+                reply = broker.answer(json.loads(line.decode('latin-1')))
+            except ValueError:
+                reply = {'error': 'MaxiGaugeError', 'message': 'Could not decode %r' % line}
+            self.wfile.write((json.dumps(reply) + '\n').encode('latin-1'))
+
+
+class SocketConnection(object):
+    ''' The part of the serial.Serial interface that FrameReader needs, for a socket '''
+    def __init__(self, sock):
+        self.socket = sock
+
+    def inWaiting(self):
+        return 4096 # recv() returns what has arrived, up to that
+
+    def read(self, size):
+        try:
+            return self.socket.recv(size)
+        except socket.timeout:
+            return b''
+
+class MaxiGaugeClient(MaxiGauge):
+    ''' A MaxiGauge whose commands are sent through a MaxiGaugeBroker.
+`serialPort` is the socket of the broker or the serial port it owns,
+`baud` is only accepted for compatibility (the broker has set up the port). '''
+    def __init__(self, serialPort, baud=9600, debug=False, reprobe_interval=30., timeout=10.):
+        self.timeout = timeout
+        MaxiGauge.__init__(self, serialPort, baud, debug, reprobe_interval)
+
+    def connect(self, path, baud=None):
+        self.path = path if is_socket(path) else socket_path(path)
+        self.open_socket()
+
+    def open_socket(self):
+        self.connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.connection.settimeout(self.timeout)
+        try:
+            self.connection.connect(self.path)
+        except socket.error as e:
+            self.connection.close()
+            raise MaxiGaugeError('No MaxiGauge broker listening on %s: %s' % (self.path, e))
+        self.reader = FrameReader(SocketConnection(self.connection), terminator='\n')
+
+    def reconnect(self):
+        ''' Starts over with a new connection, so a late answer is never taken for the next one '''
+        self.connection.close()
+        self.open_socket()
+
+    def write(self, what):
+        self.debugMessage(what)
+        if not isinstance(what, bytes): what = what.encode('latin-1')
+        self.connection.sendall(what)
+        self.bytes_written += len(what)
+
+    def transaction(self, mnemonic, numEnquiries):
+        try:
+            self.write(json.dumps({'command': mnemonic, 'enquiries': numEnquiries}) + '\n')
+        except socket.error as e:
+            self.reconnect()
+            raise MaxiGaugeError('Lost the connection to the broker: %s' % e)
+        line = self.reader.read_frame()
+        self.debugMessage(line)
+        if not line:
+            self.reconnect()
+            raise MaxiGaugeTimeout('No answer from the broker on %s' % self.path)
+        answer = json.loads(line)
+        if 'error' in answer: raise ERRORS.get(answer['error'], MaxiGaugeError)(answer['message'])
+        if self.config is not None and ',' in mnemonic: self.config.invalidate(mnemonic.split(',', 1)[0])
+        return [str(frame) for frame in answer['response']]
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- encoding: UTF8 -*-
+
+# This file is part of PfeifferVacuum.py.
+#
+# PfeifferVacuum.py is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PfeifferVacuum.py is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PfeifferVacuum.py. If not, see <http://www.gnu.org/licenses/>.
+
+
+### A cached snapshot of the configuration of a MaxiGauge
+### (measurement point names, unit, filters, set points, ...).
+### The parameters are read once and then again when they are older than
+### `ttl` seconds or were changed through MaxiGauge.send (e.g. with
+### displayContrast(12)). snapshot() never touches the serial port.
+###
+###   config = DeviceConfig(mg)
+###   config.read_all()
+###   print(config.snapshot()['CID'])
+###
+### With continuous pressure updates, the expired parameters are read a few
+### at a time after the poll cycles instead, so they hardly delay the polling:
+###
+###   mg.update_callbacks.append(config.poll)
+
+import time
+import threading
+
+from PfeifferVacuum import MaxiGaugeError
+
+### The parameters read (p.85 ff.)
+PARAMETERS = [
+  'CID', # Measurement point names
+  'UNI', # Unit of measurement
+  'SEN', # Sensor on/off
+  'TID', # Sensor identification
+  'FIL', # Filter time constant
+  'CA1', 'CA2', 'CA3', 'CA4', 'CA5', 'CA6', # Calibration factors
+  'OFC', # Offset correction
+  'FSR', # Full scale range of linear sensors
+  'PUC', # Underrange control
+  'SP1', 'SP2', 'SP3', 'SP4', 'SP5', 'SP6', # Set points A ... F: sensor, lower threshold, upper threshold
+  'DCD', # Display digits
+  'DCC', # Display contrast
+  'DCB', # Bargraph
+  'DCS', # Screensave
+  'LOC', # Parameter setup lock
+  'BAU', # Baud rate
+  'PNR', # Program number
+]
+
+### Unit of measurement as defined on p.89
+UNITS = { 0: 'mbar', 1: 'Torr', 2: 'Pa' }
+
+def parse_value(field):
+    field = field.strip()
+    for convert in (int, float):
+        try:
+            return convert(field)
+        except ValueError:
+            pass
+    return field
+
+def parse_answer(answer):
+    ''' '1' -> 1, '1,1.0000E-06' -> [1, 1e-06], 'CH1,CH2' -> ['CH1', 'CH2'] '''
+    values = [parse_value(field) for field in answer.split(',')]
+    return values[0] if len(values) == 1 else values
+
+class DeviceConfig(object):
+    def __init__(self, maxigauge, ttl=600., parameters=PARAMETERS, per_cycle=2):
+        self.maxigauge = maxigauge
+        self.ttl = ttl
+        self.parameters = list(parameters)
+        self.per_cycle = per_cycle
+        self.values = {}
+        self.read_at = dict((mnemonic, None) for mnemonic in self.parameters)
+        self.lock = threading.Lock()
+        maxigauge.config = self # invalidates the parameters changed through send()
+
+    def expired(self, now=None):
+        ''' The parameters never read, invalidated or older than ttl '''
+        if now is None: now = time.time()
+        with self.lock:
+            return [m for m in self.parameters if self.read_at[m] is None or now - self.read_at[m] > self.ttl]
+
+    def read(self, mnemonic):
+        ''' Reads one parameter from the device (None if the device doesn't know it) '''
+        try:
+            value = parse_answer(self.maxigauge.send(mnemonic, 1)[0])
+        except MaxiGaugeError:
+            value = None
+        with self.lock:
+            self.values[mnemonic] = value
+            self.read_at[mnemonic] = time.time()
+        return value
+
+    def read_all(self, force=False):
+        ''' Reads all expired parameters (all of them with force) in one pass '''
+        for mnemonic in (self.parameters if force else self.expired()):
+            self.read(mnemonic)
+        return self.snapshot()
+
+    def poll(self, readings=None):
+        ''' Reads up to per_cycle expired parameters, to be called after every poll cycle '''
+        for mnemonic in self.expired()[:self.per_cycle]:
+            self.read(mnemonic)
+
+    def invalidate(self, mnemonic=None):
+        ''' Marks a parameter (e.g. after changing it) or all of them to be read again '''
+        with self.lock:
+            for m in ([mnemonic] if mnemonic else self.parameters):
+                if m in self.read_at: self.read_at[m] = None
+
+    def snapshot(self):
+        ''' The cached parameters {mnemonic: value} and the time they were read at '''
+        with self.lock:
+            snapshot = dict(self.values)
+            snapshot['read_at'] = dict(self.read_at)
+        snapshot['unit'] = UNITS.get(snapshot.get('UNI'))
+        return snapshot
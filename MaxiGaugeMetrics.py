@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- encoding: UTF8 -*-
+
+# This file is part of PfeifferVacuum.py.
+#
+# PfeifferVacuum.py is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PfeifferVacuum.py is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PfeifferVacuum.py. If not, see <http://www.gnu.org/licenses/>.
+
+
+### Instrumentation of the serial communication with a MaxiGauge.
+### Switch it on by handing a CommandMetrics to the controller:
+###
+###   mg = MaxiGauge('/dev/ttyUSB0')
+###   mg.metrics = CommandMetrics()
+###   ...
+###   print(prometheus_text(mg))
+###
+### Without metrics (the default) MaxiGauge.send only checks for None.
+
+from bisect import bisect_left
+
+## upper bounds in seconds of the round-trip time and poll cycle buckets
+LATENCY_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1., 2., 5.)
+
+class Histogram(object):
+    ''' Counts of observations per bucket, plus their number and sum '''
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # the last one is +Inf
+        self.count = 0
+        self.sum = 0.
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        ''' Yields (upper bound, number of observations <= upper bound) '''
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            yield bound, total
+
+class CommandMetrics(object):
+    ''' Round-trip times per mnemonic, error counters and poll cycle durations '''
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.latency = {} # mnemonic -> Histogram
+        self.naks = {} # mnemonic -> count
+        self.timeouts = {} # mnemonic -> count
+        self.short_acks = 0
+        self.cycles = Histogram(buckets)
+
+    def command(self, mnemonic, seconds):
+        mnemonic = mnemonic_of(mnemonic)
+        try:
+            self.latency[mnemonic].observe(seconds)
+        except KeyError:
+            self.latency[mnemonic] = Histogram(self.buckets)
+            self.latency[mnemonic].observe(seconds)
+
+    def nak(self, mnemonic):
+        mnemonic = mnemonic_of(mnemonic)
+        self.naks[mnemonic] = self.naks.get(mnemonic, 0) + 1
+
+    def timeout(self, mnemonic):
+        mnemonic = mnemonic_of(mnemonic)
+        self.timeouts[mnemonic] = self.timeouts.get(mnemonic, 0) + 1
+
+    def short_ack(self):
+        self.short_acks += 1
+
+    def cycle(self, seconds):
+        self.cycles.observe(seconds)
+
+def mnemonic_of(command):
+    ''' The mnemonic of a command without its parameters: 'DCC,5' -> 'DCC' '''
+    return command.split(',', 1)[0].strip()
+
+### ------- Prometheus text exposition format (version 0.0.4) -------
+
+def format_value(value):
+    if value == float('inf'): return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def histogram_lines(name, histogram, labels=''):
+    sep = ',' if labels else ''
+    for bound, count in histogram.cumulative():
+        yield '%s_bucket{%s%sle="%s"} %d' % (name, labels, sep, format_value(bound), count)
+    label_set = '{%s}' % labels if labels else ''
+    yield '%s_sum%s %s' % (name, label_set, format_value(histogram.sum))
+    yield '%s_count%s %d' % (name, label_set, histogram.count)
+
+def prometheus_text(maxigauge, prefix='maxigauge'):
+    ''' The metrics of a MaxiGauge as Prometheus text '''
+    if hasattr(maxigauge, 'published_metrics'): # a SharedSnapshot.SnapshotMaxiGauge
+        return maxigauge.published_metrics()
+    metrics = maxigauge.metrics
+    lines = []
+    def header(name, kind, help):
+        lines.append('# HELP %s_%s %s' % (prefix, name, help))
+        lines.append('# TYPE %s_%s %s' % (prefix, name, kind))
+    header('bytes_sent_total', 'counter', 'Bytes written to the serial port.')
+    lines.append('%s_bytes_sent_total %d' % (prefix, maxigauge.bytes_written))
+    header('bytes_received_total', 'counter', 'Bytes read from the serial port.')
+    lines.append('%s_bytes_received_total %d' % (prefix, maxigauge.reader.bytes_read))
+    if metrics is not None:
+        header('command_seconds', 'histogram', 'Round-trip time of the commands by mnemonic.')
+        for mnemonic in sorted(metrics.latency):
+            lines.extend(histogram_lines(prefix + '_command_seconds', metrics.latency[mnemonic], 'mnemonic="%s"' % mnemonic))
+        header('naks_total', 'counter', 'Commands answered with NAK by mnemonic.')
+        for mnemonic in sorted(metrics.naks):
+            lines.append('%s_naks_total{mnemonic="%s"} %d' % (prefix, mnemonic, metrics.naks[mnemonic]))
+        header('timeouts_total', 'counter', 'Answers not received in time by mnemonic.')
+        for mnemonic in sorted(metrics.timeouts):
+            lines.append('%s_timeouts_total{mnemonic="%s"} %d' % (prefix, mnemonic, metrics.timeouts[mnemonic]))
+        header('short_acks_total', 'counter', 'Answers with only a line termination instead of ACK or NAK.')
+        lines.append('%s_short_acks_total %d' % (prefix, metrics.short_acks))
+        header('poll_cycle_seconds', 'histogram', 'Duration of the continuous pressure update cycles.')
+        lines.extend(histogram_lines(prefix + '_poll_cycle_seconds', metrics.cycles))
+    writer = getattr(maxigauge, 'logfile', None)
+    if hasattr(writer, 'depth'):
+        header('log_queue_depth', 'gauge', 'Records waiting for the log writer thread.')
+        lines.append('%s_log_queue_depth %d' % (prefix, writer.depth()))
+        header('log_records_written_total', 'counter', 'Records written by the log writer thread.')
+        lines.append('%s_log_records_written_total %d' % (prefix, writer.written))
+        header('log_records_dropped_total', 'counter', 'Records dropped because the log queue was full.')
+        lines.append('%s_log_records_dropped_total %d' % (prefix, writer.dropped))
+        header('log_write_errors_total', 'counter', 'Failed writes of the log writer thread.')
+        lines.append('%s_log_write_errors_total %d' % (prefix, writer.errors))
+    stats = maxigauge.poll_statistics
+    if stats is not None:
+        header('poll_overruns_total', 'counter', 'Poll deadlines skipped because a cycle took too long.')
+        lines.append('%s_poll_overruns_total %d' % (prefix, stats.overruns))
+        header('poll_failures_total', 'counter', 'Poll cycles that failed with a timeout or an unreadable answer.')
+        lines.append('%s_poll_failures_total %d' % (prefix, stats.failures))
+        header('poll_rate', 'gauge', 'Achieved poll cycles per second.')
+        lines.append('%s_poll_rate %s' % (prefix, format_value(stats.rate())))
+    return '\n'.join(lines) + '\n'
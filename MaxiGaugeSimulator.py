@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# -*- encoding: UTF8 -*-
+
+# This file is part of PfeifferVacuum.py.
+#
+# PfeifferVacuum.py is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PfeifferVacuum.py is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PfeifferVacuum.py. If not, see <http://www.gnu.org/licenses/>.
+
+
+### A simulated Pfeiffer Vacuum TPG256A (MaxiGauge) on a pseudo terminal.
+### It speaks the ACK/NAK/ENQ handshake described on p.81 ff. of the manual,
+### so the PfeifferVacuum module can be exercised without a real device:
+###
+###   sim = MaxiGaugeSimulator(baud=9600)
+###   sim.start()
+###   mg = MaxiGauge(sim.port)
+###
+### Running this file directly starts a simulator and prints its port.
+### Pseudo terminals are only available on Linux / Unix.
+
+import os
+import pty
+import tty
+import time
+import random
+import select
+import threading
+
+from PfeifferVacuum import C, LINE_TERMINATION
+
+class MaxiGaugeSimulator(object):
+    ''' Simulates a MaxiGauge on the slave side of a pseudo terminal.
+
+`baud`       -- transmission time per byte is 10/baud s (0 disables the delay)
+`latency`    -- processing time of the device before it answers in s
+`jitter`     -- maximum additional random delay per answer in s
+`drop_rate`  -- probability that a byte of an answer gets lost
+`nak_rate`   -- probability that a valid command is answered with NAK
+`sensors`    -- list of six (status, pressure) tuples, status as on p.88
+'''
+    def __init__(self, baud=9600, latency=0.0, jitter=0.0, drop_rate=0.0, nak_rate=0.0, sensors=None, seed=None):
+        self.baud = baud
+        self.latency = latency
+        self.jitter = jitter
+        self.drop_rate = drop_rate
+        self.nak_rate = nak_rate
+        if sensors is None:
+            sensors = [(0, 1.0e-9 * 10**i) for i in range(6)]
+        self.sensors = [list(sensor) for sensor in sensors]
+        self.random = random.Random(seed)
+        self.parameters = {
+          'BAU': '1',
+          'CID': 'CH1,CH2,CH3,CH4,CH5,CH6',
+          'DCB': '0',
+          'DCC': '10',
+          'DCD': '2',
+          'DCS': '0',
+          'ERR': '0000,0000',
+          'FIL': '1,1,1,1,1,1',
+          'FSR': '0,0,0,0,0,0',
+          'LOC': '0',
+          'OFC': '0,0,0,0,0,0',
+          'PNR': 'BG 5500-1',
+          'PUC': '0,0,0,0,0,0',
+          'TKB': '0',
+          'UNI': '0',
+        }
+        for i in range(1, 7):
+            self.parameters['CA%d' % i] = '1.000'
+            self.parameters['SP%d' % i] = '%d,1.0000E-06,2.0000E-06' % i
+        self.commands = 0
+        self.naks = 0
+        self.dropped = 0
+        self.pending = None
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.master)
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.serve)
+        self.thread.daemon = True
+        self.thread.start()
+        return self.port
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread: self.thread.join()
+        self.thread = None
+        os.close(self.master)
+        os.close(self.slave)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def serve(self):
+        buf = b''
+        enq = C['ENQ'].encode('latin-1')
+        etx = C['ETX'].encode('latin-1')
+        term = LINE_TERMINATION.encode('latin-1')
+        while not self.stopping.is_set():
+            if not select.select([self.master], [], [], 0.05)[0]: continue
+            try:
+                data = os.read(self.master, 1024)
+            except OSError:
+                return
+            if not data: return
+            buf += data
+            while buf:
+                if buf[:1] == enq:
+                    buf = buf[1:]
+                    self.enquiry()
+                elif buf[:1] == etx:
+                    buf = buf[1:]
+                    self.pending = None
+                elif term in buf:
+                    line, buf = buf.split(term, 1)
+                    self.command(line.decode('latin-1'))
+                else:
+                    break
+
+    def transmit(self, text):
+        data = bytearray((text + LINE_TERMINATION).encode('latin-1'))
+        if self.drop_rate:
+            for i in reversed(range(len(data))):
+                if self.random.random() < self.drop_rate:
+                    del data[i]
+                    self.dropped += 1
+        delay = self.latency + self.random.uniform(0, self.jitter)
+        if self.baud: delay += 10. * len(data) / self.baud
+        if delay > 0: time.sleep(delay)
+        os.write(self.master, bytes(data))
+
+    def command(self, line):
+        self.commands += 1
+        mnemonic, args = line[:3], line[4:] if len(line) > 3 else None
+        answer = self.answer(mnemonic, args)
+        if answer is None or self.random.random() < self.nak_rate:
+            self.naks += 1
+            self.pending = '4096,0000' if answer is None else '8192,0000'
+            self.transmit(C['NAK'])
+        else:
+            self.pending = answer
+            self.transmit(C['ACQ'])
+
+    def enquiry(self):
+        if self.pending is None: return
+        self.transmit(self.pending)
+
+    def answer(self, mnemonic, args):
+        ''' Return the string sent upon ENQ or None for a syntax error. '''
+        if len(mnemonic) == 3 and mnemonic[:2] == 'PR' and mnemonic[2] in '123456' and not args:
+            status, pressure = self.sensors[int(mnemonic[2]) - 1]
+            return '%d,%.4E' % (status, pressure)
+        if mnemonic == 'SEN':
+            if args:
+                for sensor, change in zip(self.sensors, args.split(',')):
+                    if sensor[0] == 5: continue
+                    if change == '1': sensor[0] = 4
+                    if change == '2' and sensor[0] == 4: sensor[0] = 0
+            return ','.join('0' if status == 5 else ('1' if status == 4 else '2') for status, pressure in self.sensors)
+        if mnemonic not in self.parameters: return None
+        if args: self.parameters[mnemonic] = args
+        return self.parameters[mnemonic]
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Simulate a MaxiGauge on a pseudo terminal')
+    parser.add_argument("--baud", type=int, default=9600, help="simulated baud rate, 0 for no delay")
+    parser.add_argument("--latency", type=float, default=0.0, help="processing time per answer in s")
+    parser.add_argument("--jitter", type=float, default=0.0, help="maximum random delay per answer in s")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="probability of losing a byte")
+    parser.add_argument("--nak-rate", type=float, default=0.0, help="probability of a NAK answer")
+    args = parser.parse_args()
+    sim = MaxiGaugeSimulator(args.baud, args.latency, args.jitter, args.drop_rate, args.nak_rate)
+    print("Simulated MaxiGauge listening on %s (Ctrl-C to stop)" % sim.start())
+    try:
+        while True: time.sleep(1)
+    except KeyboardInterrupt:
+        sim.stop()
@@ -0,0 +1,1002 @@
+#!/usr/bin/env python
+# -*- encoding: UTF8 -*-
+
+# This file is part of PfeifferVacuum.py.
+#
+# PfeifferVacuum.py is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PfeifferVacuum.py is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PfeifferVacuum.py. If not, see <http://www.gnu.org/licenses/>.
+
+
+### Storage of the measurement log.
+###
+### Besides the text format of measurement-data.txt
+###   "%d, %.3E, %.3E, %.3E, %.3E, %.3E, %.3E" (empty fields for invalid values)
+### there is a binary format with fixed size records, which can be mapped
+### into memory with NumPy without parsing anything:
+###
+###   header (32 bytes): magic 'MAXIGLOG', uint32 version, uint32 record size, 16 bytes reserved
+###   records (64 bytes each, little endian):
+###     float64 time, 6 x float64 pressure (NaN if invalid), 6 x uint8 status, 2 bytes padding
+###
+### The status bytes are those of PRESSURE_READING_STATUS (p.88),
+### STATUS_UNKNOWN marks values whose status was not recorded.
+###
+### NumPy is only needed for reading binary logs and for the block wise
+### processing of text logs (parse_text_block, aggregate_text_log).
+###
+### Text logs can be split into segments (see RotatingTextLog below), all
+### functions reading a text log by its filename read across the segments.
+
+import os
+import re
+import math
+import time
+import gzip
+import struct
+import shutil
+import itertools
+import calendar
+import threading
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+MAGIC = b'MAXIGLOG'
+VERSION = 1
+HEADER = struct.Struct('<8sII16x')
+RECORD = struct.Struct('<d6d6B2x')
+STATUS_UNKNOWN = 255
+
+def record_dtype():
+    import numpy
+    return numpy.dtype([('time', '<f8'), ('pressure', '<f8', (6,)), ('status', 'u1', (6,)), ('padding', 'V2')])
+
+class BinaryLogWriter(object):
+    ''' Appends records to a binary measurement log, creating it with a header if needed. '''
+    def __init__(self, filename):
+        self.filename = filename
+        self.logfile = open(filename, 'ab')
+        if self.logfile.tell() == 0:
+            self.logfile.write(HEADER.pack(MAGIC, VERSION, RECORD.size))
+        else:
+            check_header(filename)
+            # drop an incomplete record at the end (e.g. after a power cut)
+            size = self.logfile.tell()
+            excess = (size - HEADER.size) % RECORD.size
+            if excess:
+                self.logfile.truncate(size - excess)
+                self.logfile.seek(0, os.SEEK_END)
+
+    def write(self, logtime, logvalues, statuses=None):
+        self.logfile.write(self.pack(logtime, logvalues, statuses))
+
+    def write_many(self, records):
+        ''' Writes a list of (logtime, logvalues, statuses) with one call '''
+        self.logfile.write(b''.join([self.pack(*record) for record in records]))
+
+    def pack(self, logtime, logvalues, statuses=None):
+        if statuses is None:
+            statuses = [STATUS_UNKNOWN if math.isnan(val) else 0 for val in logvalues]
+        return RECORD.pack(*([logtime] + list(logvalues) + list(statuses)))
+
+    def flush(self):
+        self.logfile.flush()
+
+    def sync(self):
+        ''' Flushes and makes sure the data is on the disk '''
+        self.logfile.flush()
+        os.fsync(self.logfile.fileno())
+
+    def close(self):
+        self.logfile.close()
+
+def check_header(filename):
+    with open(filename, 'rb') as f:
+        magic, version, record_size = HEADER.unpack(f.read(HEADER.size))
+    if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+        raise ValueError('%s is not a binary measurement log (version %d)' % (filename, VERSION))
+
+def read_binary_log(filename):
+    ''' Maps a binary measurement log into memory.
+Returns the column arrays (time, pressure, status) with the shapes
+(N,), (N, 6) and (N, 6). No data is copied or parsed. '''
+    import numpy
+    check_header(filename)
+    dtype = record_dtype()
+    count = (os.path.getsize(filename) - HEADER.size) // dtype.itemsize
+    if count == 0:
+        return numpy.zeros(0), numpy.zeros((0, 6)), numpy.zeros((0, 6), dtype='u1')
+    records = numpy.memmap(filename, dtype=dtype, mode='r', offset=HEADER.size, shape=(count,))
+    return records['time'], records['pressure'], records['status']
+
+def parse_text_line(line):
+    ''' Parses a line of measurement-data.txt into (time, [6 values]) or returns None. '''
+    fields = line.split(',')
+    if len(fields) != 7: return None
+    try:
+        return int(fields[0]), [float(val) if val.strip() else float('nan') for val in fields[1:]]
+    except ValueError:
+        return None
+
+def convert_text_log(textfilename, binaryfilename):
+    ''' Converts a text measurement log into the binary format, returns the number of records. '''
+    writer = BinaryLogWriter(binaryfilename)
+    count = 0
+    with open(textfilename, 'r') as f:
+        for line in f:
+            row = parse_text_line(line)
+            if row is None: continue # e.g. the line with the column titles
+            writer.write(row[0], row[1])
+            count += 1
+    writer.close()
+    return count
+
+EMPTY_FIELD = re.compile(b',[ \t]*(?=,|\r?\n|$)')
+
+def parse_text_block(lines, columns=7):
+    ''' Parses a list of lines of the text log (bytes) at once with NumPy.
+Lines without `columns` fields are skipped, empty fields become NaN.
+Returns an array of shape (number of valid lines, columns). '''
+    import numpy
+    valid = [line for line in lines if line.count(b',') == columns - 1]
+    if not valid: return numpy.zeros((0, columns))
+    text = EMPTY_FIELD.sub(b',nan', b''.join(valid)).replace(b'\n', b',')
+    try:
+        values = numpy.fromstring(text.decode('latin-1'), sep=',')
+    except ValueError:
+        values = None
+    if values is None or values.size != len(valid) * columns:
+        # some line holds a field that is not a number (e.g. repeated column titles)
+        rows = []
+        for line in valid:
+            try:
+                rows.append([float(val) if val.strip() else float('nan') for val in line.split(b',')])
+            except ValueError:
+                pass
+        values = numpy.array(rows) if rows else numpy.zeros((0, columns))
+    return values.reshape(-1, columns)
+
+def read_text_blocks(f, block_size=1<<22):
+    ''' Yields lists of complete lines of about block_size bytes from f (binary mode). '''
+    while True:
+        lines = f.readlines(block_size)
+        if not lines: return
+        yield lines
+
+def line_time(line):
+    ''' Returns the time stamp of a line of the text log or None. '''
+    try:
+        return int(line.split(b',', 1)[0])
+    except ValueError:
+        return None
+
+def find_text_offset(f, timestamp):
+    ''' Binary search in the time ordered text log opened as `f` (binary mode).
+Returns the offset of the first line logged at or after timestamp.
+Only O(log(size)) lines are read, whatever the size of the log. '''
+    def line_start(pos):
+        # offset of the first line starting at or after pos
+        if pos == 0: return 0
+        f.seek(pos - 1)
+        f.readline()
+        return f.tell()
+    def reached(pos):
+        f.seek(line_start(pos))
+        while True:
+            line = f.readline()
+            if not line: return True
+            t = line_time(line)
+            if t is not None: return t >= timestamp
+            # skip lines without a time stamp (e.g. the column titles)
+    f.seek(0, os.SEEK_END)
+    lo, hi = 0, f.tell()
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if reached(mid): hi = mid
+        else: lo = mid + 1
+    return line_start(lo)
+
+### ------ Segments ------
+### With rotation the text log <base><ext> only holds the current period
+### (a day by default). When the period is over, it is renamed to
+### <base>-<UTC time of its first line, e.g. 20261018T000012Z><ext> and
+### compressed with gzip in the background to <base>-<time><ext>.gz.
+### Every segment starts with the column titles of the log.
+
+SEGMENT_SECONDS = 86400
+SEGMENT_TIME = '%Y%m%dT%H%M%SZ'
+
+def segment_name(logfilename, start):
+    base, ext = os.path.splitext(logfilename)
+    return '%s-%s%s' % (base, time.strftime(SEGMENT_TIME, time.gmtime(start)), ext)
+
+def log_segments(logfilename):
+    ''' Returns [(start, filename), ...] of the closed segments of a text log,
+oldest first, followed by the live log itself (its start is the time of
+its first line or None if it is empty). '''
+    directory = os.path.dirname(logfilename)
+    base, ext = os.path.splitext(os.path.basename(logfilename))
+    prefix = base + '-'
+    found = {}
+    for name in os.listdir(directory or '.'):
+        if not name.startswith(prefix): continue
+        stamp = name[len(prefix):]
+        if stamp.endswith(ext + '.gz'): stamp = stamp[:-len(ext + '.gz')]
+        elif stamp.endswith(ext): stamp = stamp[:len(stamp) - len(ext)]
+        else: continue
+        try:
+            start = calendar.timegm(time.strptime(stamp, SEGMENT_TIME))
+        except ValueError:
+            continue # e.g. the log of another controller
+        # while a segment is being compressed both files exist, the uncompressed one is complete
+        if start not in found or not name.endswith('.gz'): found[start] = os.path.join(directory, name)
+    segments = sorted(found.items())
+    if os.path.exists(logfilename): segments.append((first_line_time(logfilename), logfilename))
+    return segments
+
+def segments_in_range(logfilename, start=None, end=None):
+    ''' Returns the filenames of the segments of a text log with lines logged in [start, end). '''
+    segments = log_segments(logfilename)
+    selected = []
+    for i, (first, filename) in enumerate(segments):
+        following = segments[i+1][0] if i + 1 < len(segments) else None
+        if end is not None and first is not None and first >= end: continue
+        if start is not None and following is not None and following <= start: continue
+        selected.append(filename)
+    return selected
+
+def open_segment(filename):
+    ''' Opens a (compressed) segment in binary mode '''
+    if filename.endswith('.gz'): return gzip.open(filename, 'rb')
+    try:
+        return open(filename, 'rb')
+    except IOError:
+        # compressed in the meantime
+        if os.path.exists(filename + '.gz'): return gzip.open(filename + '.gz', 'rb')
+        raise
+
+def segment_lines(filename, start=None, end=None):
+    ''' Yields the lines of one segment logged in [start, end) (without the column titles).
+Only uncompressed segments can be searched, compressed ones are read from their beginning. '''
+    with open_segment(filename) as f:
+        if start is not None and not filename.endswith('.gz'): f.seek(find_text_offset(f, start))
+        for line in f:
+            t = line_time(line)
+            if t is None or (start is not None and t < start): continue
+            if end is not None and t >= end: return
+            yield line
+
+compression_lock = threading.Lock() # one segment at a time
+
+def compress_segment(filename):
+    ''' Replaces a closed segment by its gzip compressed version '''
+    with compression_lock:
+        if not os.path.exists(filename): return # done already
+        if not os.path.exists(filename + '.gz'):
+            with open(filename, 'rb') as f:
+                out = gzip.open(filename + '.gz.tmp', 'wb')
+                try:
+                    shutil.copyfileobj(f, out)
+                finally:
+                    out.close()
+            os.rename(filename + '.gz.tmp', filename + '.gz')
+        os.remove(filename)
+
+def compress_segments(logfilename):
+    ''' Compresses all closed segments of a text log that are not compressed yet '''
+    for start, filename in log_segments(logfilename):
+        if filename != logfilename and not filename.endswith('.gz'): compress_segment(filename)
+
+class RotatingTextLog(object):
+    ''' The file object of a text log which starts a new segment every
+`seconds` (at multiples of it in UTC). Call rotate(logtime) before
+writing the line of logtime. Closed segments are compressed in the background. '''
+    def __init__(self, filename, seconds=SEGMENT_SECONDS, compress=True):
+        self.filename = filename
+        self.seconds = seconds
+        self.compress = compress
+        first = first_line_time(filename) if os.path.exists(filename) else None
+        self.period = self.period_of(first) if first is not None else None # start of the live segment
+        self.logfile = open(filename, 'a')
+        # segments left uncompressed by an earlier run
+        if compress: self.in_background(compress_segments, filename)
+
+    def period_of(self, logtime):
+        return int(logtime // self.seconds) * self.seconds
+
+    def due(self, logtime):
+        ''' Whether the line of logtime belongs into a new segment '''
+        if self.period is None: self.period = self.period_of(logtime)
+        return logtime >= self.period + self.seconds
+
+    def in_background(self, function, *args):
+        t = threading.Thread(target=function, args=args)
+        t.daemon = True
+        t.start()
+
+    def rotate(self, logtime):
+        if not self.due(logtime): return
+        self.period = self.period_of(logtime)
+        self.logfile.flush()
+        first = first_line_time(self.filename)
+        if first is None: return # nothing logged in the last period
+        titles = text_log_titles(self.filename)
+        self.logfile.close()
+        segment = segment_name(self.filename, first)
+        os.rename(self.filename, segment)
+        self.logfile = open(self.filename, 'a')
+        for line in titles: self.logfile.write(line.decode('latin-1'))
+        if self.compress: self.in_background(compress_segment, segment)
+
+    def write(self, text):
+        self.logfile.write(text)
+
+    def flush(self):
+        self.logfile.flush()
+
+    def fileno(self):
+        return self.logfile.fileno()
+
+    def close(self):
+        self.logfile.close()
+
+class TextLogWriter(object):
+    ''' Appends lines to a text log, a RotatingTextLog if segment_seconds is given.
+Has the same methods as BinaryLogWriter. '''
+    def __init__(self, filename, segment_seconds=None):
+        self.filename = filename
+        self.logfile = RotatingTextLog(filename, segment_seconds) if segment_seconds else open(filename, 'a')
+
+    def write(self, logtime, logvalues, statuses=None):
+        self.write_many([(logtime, logvalues, statuses)])
+
+    def write_many(self, records):
+        ''' Writes a list of (logtime, logvalues, statuses) with one call (per segment) '''
+        rotating = isinstance(self.logfile, RotatingTextLog)
+        lines = []
+        for logtime, logvalues, statuses in records:
+            if rotating and self.logfile.due(logtime):
+                self.logfile.write(''.join(lines))
+                lines = []
+                self.logfile.rotate(logtime)
+            lines.append(format_text_line(logtime, logvalues) + '\n')
+        self.logfile.write(''.join(lines))
+
+    def flush(self):
+        self.logfile.flush()
+
+    def sync(self):
+        self.logfile.flush()
+        os.fsync(self.logfile.fileno())
+
+    def close(self):
+        self.logfile.close()
+
+### ------ Writing in the background ------
+
+monotonic = getattr(time, 'monotonic', time.time)
+
+class BackgroundLogWriter(object):
+    ''' Hands the records to a thread which writes them to the targets
+(e.g. a TextLogWriter and a RollupPyramid), so a slow disk never holds up the acquisition.
+All records waiting in the bounded queue are written in one batch,
+the targets are flushed every flush_interval and, if fsync_interval is given,
+synced to the disk every fsync_interval seconds.
+If the queue is full, write() waits for room (overflow='block')
+or drops the record (overflow='drop'). '''
+    def __init__(self, targets, queue_size=10000, flush_interval=1., fsync_interval=None, overflow='block', batch_size=1000):
+        if overflow not in ('block', 'drop'): raise ValueError("overflow has to be 'block' or 'drop'")
+        self.targets = targets
+        self.queue = queue.Queue(queue_size)
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+        self.overflow = overflow
+        self.batch_size = batch_size
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0 # failed writes, e.g. with a full disk
+        self.batches = 0
+        self.max_depth = 0
+        self.flush_requested = threading.Event()
+        self.closing = False
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def write(self, logtime, logvalues, statuses=None):
+        try:
+            self.queue.put((logtime, logvalues, statuses), self.overflow == 'block')
+        except queue.Full:
+            self.dropped += 1
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+
+    def depth(self):
+        ''' Number of records waiting to be written '''
+        return self.queue.qsize()
+
+    def flush(self):
+        ''' Asks the writer thread to write and flush everything queued so far, without waiting for it '''
+        self.flush_requested.set()
+        try:
+            self.queue.put_nowait(None) # wakes up the writer thread
+        except queue.Full:
+            pass
+
+    def close(self):
+        ''' Writes all queued records, flushes (and syncs) the targets and stops the thread.
+The targets are not closed. '''
+        self.closing = True
+        self.queue.put(None)
+        self.thread.join()
+
+    def run(self):
+        dirty = False
+        next_flush = monotonic() + self.flush_interval
+        next_sync = monotonic() + self.fsync_interval if self.fsync_interval else None
+        while True:
+            try:
+                batch = [self.queue.get(timeout=max(0., next_flush - monotonic()) if dirty else None)]
+            except queue.Empty:
+                batch = []
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            records = [record for record in batch if record is not None]
+            if records:
+                for target in self.targets:
+                    try:
+                        if hasattr(target, 'write_many'): target.write_many(records)
+                        else:
+                            for record in records: target.write(*record)
+                    except (IOError, OSError):
+                        self.errors += 1
+                self.written += len(records)
+                self.batches += 1
+                dirty = True
+            now = monotonic()
+            if dirty and (now >= next_flush or self.flush_requested.is_set()):
+                self.flush_requested.clear()
+                self.flush_targets(next_sync is not None and now >= next_sync)
+                dirty = False
+                next_flush = now + self.flush_interval
+                if next_sync is not None and now >= next_sync: next_sync = now + self.fsync_interval
+            if self.closing and self.queue.empty():
+                self.flush_targets(next_sync is not None)
+                return
+
+    def flush_targets(self, sync=False):
+        for target in self.targets:
+            try:
+                if sync and hasattr(target, 'sync'): target.sync()
+                elif hasattr(target, 'flush'): target.flush()
+            except (IOError, OSError):
+                self.errors += 1
+
+### ------ Reading text logs (across all segments) ------
+
+def text_log_range(filename, start=None, end=None, lines=None):
+    ''' Yields the column titles and then the lines of the text log
+logged in [start, end). Only the requested part of the log is read.
+If `lines` is given, only about that many evenly spaced lines are returned. '''
+    segments = segments_in_range(filename, start, end)
+    if segments == [filename]:
+        for line in text_file_range(filename, start, end, lines): yield line
+        return
+    for line in text_log_titles(filename): yield line
+    if not lines:
+        for segment in segments:
+            for line in segment_lines(segment, start, end): yield line
+        return
+    # across segments the lines are thinned out by time: the first line of every slot
+    first = start if start is not None else first_log_time(filename)
+    if first is None: return
+    width = max(1., float((end if end is not None else time.time()) - first) / lines)
+    slot = None
+    for segment in segments:
+        for line in segment_lines(segment, start, end):
+            n = (line_time(line) - first) // width
+            if n != slot: yield line
+            slot = n
+
+def text_file_range(filename, start=None, end=None, lines=None):
+    ''' text_log_range() of a single uncompressed file, thinned out by line count. '''
+    with open(filename, 'rb') as f:
+        titles = f.readline()
+        if line_time(titles) is None: yield titles
+        begin = find_text_offset(f, start) if start is not None else 0
+        every = 1
+        if lines:
+            f.seek(0, os.SEEK_END)
+            stop = find_text_offset(f, end) if end is not None else f.tell()
+            f.seek(begin)
+            # the average length of some data lines, not of the column titles
+            sample = [len(line) for line in itertools.islice(f, 20) if line_time(line) is not None]
+            line_length = max(1, sum(sample) // len(sample)) if sample else 1
+            every = max(1, (stop - begin) // (line_length * lines))
+        f.seek(begin)
+        i = 0
+        for line in f:
+            t = line_time(line)
+            if t is None: continue
+            if end is not None and t >= end: break
+            if i % every == 0: yield line
+            i += 1
+
+def text_log_bytes(filename, size=1<<16):
+    ''' Yields the whole text log, all segments one after the other,
+in blocks of bytes with the column titles only at the beginning. '''
+    for i, segment in enumerate(segments_in_range(filename)):
+        with open_segment(segment) as f:
+            if i > 0:
+                titles = f.readline()
+                if line_time(titles) is not None: yield titles
+            while True:
+                block = f.read(size)
+                if not block: break
+                yield block
+
+def text_log_titles(filename):
+    ''' Returns the line with the column titles of a text log as a list (empty if there is none). '''
+    segments = segments_in_range(filename)
+    if not segments: return []
+    with open_segment(segments[-1] if segments[-1] == filename else segments[0]) as f:
+        titles = f.readline()
+    return [titles] if titles and line_time(titles) is None else []
+
+def first_line_time(filename):
+    ''' Returns the time stamp of the first line of a single (compressed) text file or None. '''
+    with open_segment(filename) as f:
+        for i, line in enumerate(f):
+            t = line_time(line)
+            if t is not None or i > 10: return t
+
+def first_log_time(filename):
+    ''' Returns the time stamp of the first line of a text log or None. '''
+    for start, segment in log_segments(filename):
+        if start is not None: return start
+
+def text_log_blocks(filename, start=None, end=None):
+    ''' Yields the lines of the text log logged in [start, end) as arrays of shape (k, 7). '''
+    import numpy
+    for segment in segments_in_range(filename, start, end):
+        with open_segment(segment) as f:
+            offset = find_text_offset(f, start) if start is not None and not segment.endswith('.gz') else 0
+            f.seek(offset)
+            # skip the column titles
+            if offset == 0 and line_time(f.readline()) is not None: f.seek(0)
+            for lines in read_text_blocks(f):
+                block = parse_text_block(lines)
+                if start is not None and len(block) and block[0, 0] < start:
+                    block = block[block[:, 0] >= start]
+                if end is not None and len(block) and block[-1, 0] >= end:
+                    yield block[:numpy.argmax(block[:, 0] >= end)]
+                    return
+                yield block
+
+def format_text_line(logtime, logvalues):
+    return "%d, " % logtime + ', '.join(["%.3E" % val if not math.isnan(val) else '' for val in logvalues])
+
+def aggregate_text_log(filename, start=None, end=None, buckets=1000, aggregate='mean'):
+    ''' Aggregates the text log in [start, end) into `buckets` buckets of equal length,
+ignoring NaN. Yields lines like those of the text log, one per bucket or,
+for the peak preserving aggregate 'minmax', two per bucket: the minima and the maxima. '''
+    try:
+        import numpy
+    except ImportError:
+        for line in aggregate_text_lines(filename, start, end, buckets, aggregate): yield line
+        return
+    if start is None: start = first_log_time(filename)
+    if start is None: return
+    if end is None: end = time.time()
+    width = max(1., float(end - start) / buckets)
+    def lines(bucket, count, total, minimum, maximum):
+        logtime = start + bucket * width
+        if aggregate == 'mean':
+            with numpy.errstate(invalid='ignore', divide='ignore'):
+                return [format_text_line(logtime, numpy.where(count > 0, total / count, numpy.nan))]
+        if aggregate == 'min': return [format_text_line(logtime, minimum)]
+        if aggregate == 'max': return [format_text_line(logtime, maximum)]
+        return [format_text_line(logtime, minimum), format_text_line(logtime + width / 2, maximum)]
+    pending = None
+    for block in text_log_blocks(filename, start, end):
+        if len(block) == 0: continue
+        bucket = ((block[:, 0] - start) // width).astype(int)
+        first = numpy.concatenate(([0], numpy.flatnonzero(numpy.diff(bucket)) + 1))
+        values = block[:, 1:]
+        valid = ~numpy.isnan(values)
+        count = numpy.add.reduceat(valid.astype(int), first)
+        total = numpy.add.reduceat(numpy.where(valid, values, 0.), first)
+        minimum = numpy.fmin.reduceat(values, first)
+        maximum = numpy.fmax.reduceat(values, first)
+        output = []
+        for i, b in enumerate(bucket[first]):
+            if pending is not None and pending[0] == b:
+                # the bucket continues from the previous block
+                pending = [b, pending[1] + count[i], pending[2] + total[i], numpy.fmin(pending[3], minimum[i]), numpy.fmax(pending[4], maximum[i])]
+                continue
+            if pending is not None: output += lines(*pending)
+            pending = [b, count[i], total[i], minimum[i], maximum[i]]
+        for line in output: yield (line + '\n').encode('latin-1')
+    if pending is not None:
+        for line in lines(*pending): yield (line + '\n').encode('latin-1')
+
+def aggregate_text_lines(filename, start=None, end=None, buckets=1000, aggregate='mean'):
+    ''' aggregate_text_log() without NumPy, parsing the log line by line (slower). '''
+    if start is None: start = first_log_time(filename)
+    if start is None: return
+    if end is None: end = time.time()
+    width = max(1., float(end - start) / buckets)
+    nan = float('nan')
+    def lines(bucket, count, total, minimum, maximum):
+        logtime = start + bucket * width
+        if aggregate == 'mean': return [format_text_line(logtime, [t / c if c else nan for c, t in zip(count, total)])]
+        if aggregate == 'min': return [format_text_line(logtime, minimum)]
+        if aggregate == 'max': return [format_text_line(logtime, maximum)]
+        return [format_text_line(logtime, minimum), format_text_line(logtime + width / 2, maximum)]
+    pending = None
+    for segment in segments_in_range(filename, start, end):
+        for line in segment_lines(segment, start, end):
+            parsed = parse_text_line(line.decode('latin-1') if isinstance(line, bytes) else line)
+            if parsed is None: continue
+            b = int((parsed[0] - start) // width)
+            if pending is None or pending[0] != b:
+                if pending is not None:
+                    for output in lines(*pending): yield (output + '\n').encode('latin-1')
+                pending = [b, [0] * 6, [0.] * 6, [nan] * 6, [nan] * 6]
+            for i, val in enumerate(parsed[1]):
+                if math.isnan(val): continue
+                pending[1][i] += 1
+                pending[2][i] += val
+                # NaN compares false, the first value replaces it
+                if not pending[3][i] <= val: pending[3][i] = val
+                if not pending[4][i] >= val: pending[4][i] = val
+    if pending is not None:
+        for output in lines(*pending): yield (output + '\n').encode('latin-1')
+
+### ------ Rollups ------
+### For every tier (bucket length in seconds) the logger keeps a text file
+### <logfile>.rollup-<seconds>s.txt with one line per finished bucket:
+###   "bucket start, count 1, mean 1, min 1, max 1, ..., count 6, mean 6, min 6, max 6"
+### The bucket currently filled is only written when the next one starts
+### (or by close(), the next writer takes that row back and continues it).
+### Only one process writes the tiers (writer=True), any number may query them.
+
+ROLLUP_TIERS = (10, 60, 600, 3600)
+AGGREGATES = ('mean', 'min', 'max', 'minmax')
+
+class RollupTier(object):
+    def __init__(self, filename, seconds, rebuild=False, writer=False):
+        self.filename = filename
+        self.seconds = seconds
+        self.bucket = None
+        self.first = None
+        self.logfile = None # only queried
+        if not (writer or rebuild): return
+        if not rebuild: self.resume()
+        self.logfile = open(filename, 'w' if rebuild else 'a')
+        if self.logfile.tell() == 0:
+            self.logfile.write("Bucket start, " + ', '.join(["Gauge %d count, Gauge %d mean, Gauge %d min, Gauge %d max" % ((i+1,)*4) for i in range(6)]) + '\n')
+
+    def resume(self):
+        ''' Takes the last bucket of the file (written by close(), maybe unfinished)
+off the file and continues it '''
+        try:
+            f = open(self.filename, 'rb+')
+        except IOError:
+            return
+        with f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            f.seek(max(0, size - 4096))
+            tail = f.read()
+            start = tail.rfind(b'\n', 0, len(tail) - 1) + 1
+            fields = tail[start:].split(b',')
+            if line_time(tail[start:]) is None or len(fields) != 25: return
+            self.bucket = int(fields[0])
+            self.count = [int(fields[4*i + 1]) for i in range(6)]
+            values = [[float(field) if field.strip() else 0. for field in fields[4*i + 2:4*i + 5]] for i in range(6)]
+            self.total = [mean * n for (mean, low, high), n in zip(values, self.count)]
+            self.minimum = [low if n else float('inf') for (mean, low, high), n in zip(values, self.count)]
+            self.maximum = [high if n else float('-inf') for (mean, low, high), n in zip(values, self.count)]
+            f.truncate(size - (len(tail) - start))
+
+    def first_bucket(self):
+        ''' The start of the oldest bucket in the tier (the one being filled if none is written yet) or None '''
+        if self.first is None:
+            if not os.path.exists(self.filename): return self.bucket
+            with open(self.filename, 'rb') as f:
+                for line in f:
+                    self.first = line_time(line)
+                    if self.first is not None: break
+        return self.first if self.first is not None else self.bucket
+
+    def add(self, logtime, logvalues):
+        if self.logfile is None: raise IOError('%s was opened for queries only' % self.filename)
+        bucket = int(logtime // self.seconds) * self.seconds
+        if bucket != self.bucket:
+            if self.bucket is not None:
+                self.logfile.write(self.row() + '\n')
+                self.logfile.flush()
+            self.bucket = bucket
+            self.count = [0] * 6
+            self.total = [0.] * 6
+            self.minimum = [float('inf')] * 6
+            self.maximum = [float('-inf')] * 6
+        for i, val in enumerate(logvalues):
+            if math.isnan(val): continue
+            self.count[i] += 1
+            self.total[i] += val
+            if val < self.minimum[i]: self.minimum[i] = val
+            if val > self.maximum[i]: self.maximum[i] = val
+
+    def row(self):
+        fields = ["%d, %.3E, %.3E, %.3E" % (self.count[i], self.total[i] / self.count[i], self.minimum[i], self.maximum[i])
+                  if self.count[i] else "0, , , " for i in range(6)]
+        return "%d, " % self.bucket + ', '.join(fields)
+
+    def lines(self, start=None, end=None, lines=None, aggregate='mean'):
+        ''' Yields the buckets in [start, end) like lines of the text log,
+using the `aggregate` (mean, min or max) as value of every gauge.
+The aggregate minmax yields two lines per bucket, the minima and the maxima. '''
+        # thinning out the buckets would lose the peaks of min, max and minmax
+        rows = text_log_range(self.filename, start, end, lines if aggregate == 'mean' else None)
+        next(rows, None) # column titles
+        for row in rows:
+            for line in self.convert(row, aggregate): yield line
+        if self.bucket is not None and (end is None or self.bucket < end):
+            # the bucket still being filled
+            for line in self.convert(self.row().encode('latin-1'), aggregate): yield line
+
+    def convert(self, row, aggregate):
+        fields = row.split(b',')
+        if aggregate == 'minmax':
+            # peak preserving: the minima at the bucket start, the maxima in the middle of the bucket
+            return [b', '.join([fields[0]] + [fields[4*i + 3].strip() for i in range(6)]) + b'\n',
+                    b', '.join([str(int(fields[0]) + self.seconds // 2).encode('latin-1')] + [fields[4*i + 4].strip() for i in range(6)]) + b'\n']
+        k = 2 + AGGREGATES.index(aggregate)
+        return [b', '.join([fields[0]] + [fields[4*i + k].strip() for i in range(6)]) + b'\n']
+
+    def close(self):
+        ''' Writes the bucket being filled, too: it is continued by the next writer of the file '''
+        if self.logfile is None: return
+        if self.bucket is not None: self.logfile.write(self.row() + '\n')
+        self.bucket = None
+        self.logfile.close()
+
+class RollupPyramid(object):
+    ''' Keeps the rollup tiers of a text log up to date, call add() for every logged line.
+Without writer=True (for the one process logging) the tiers are only queried. '''
+    def __init__(self, logfilename, tiers=ROLLUP_TIERS, rebuild=False, writer=False):
+        self.logfilename = logfilename
+        base = os.path.splitext(logfilename)[0]
+        self.tiers = [RollupTier("%s.rollup-%ds.txt" % (base, seconds), seconds, rebuild, writer) for seconds in sorted(tiers)]
+
+    def add(self, logtime, logvalues):
+        for tier in self.tiers:
+            tier.add(logtime, logvalues)
+
+    def write(self, logtime, logvalues, statuses=None):
+        ''' add() as a target of a BackgroundLogWriter '''
+        self.add(logtime, logvalues)
+
+    def choose_tier(self, resolution):
+        ''' Returns the coarsest tier with buckets not longer than resolution (in s) or None. '''
+        suitable = [tier for tier in self.tiers if tier.seconds <= resolution]
+        return suitable[-1] if suitable else None
+
+    def query(self, start=None, end=None, lines=1000, aggregate='mean'):
+        ''' Yields about `lines` lines (plus column titles) covering [start, end)
+from the coarsest suitable tier. Returns None if the raw log has to be used. '''
+        first = start if start is not None else first_log_time(self.logfilename)
+        if first is None: return None
+        span = (end if end is not None else time.time()) - first
+        tier = self.choose_tier(float(span) / max(1, lines))
+        if tier is None: return None
+        # the tiers only start with the lines logged since they were created (unless build-rollups.py was run)
+        covered = tier.first_bucket()
+        if covered is None or (end is not None and end <= covered): return None
+        if covered <= first: return self.tier_query(tier, start, end, lines, aggregate)
+        return self.tier_query(tier, covered, end, lines, aggregate, (first, max(1, int(lines * (covered - first) / span))))
+
+    def tier_query(self, tier, start, end, lines, aggregate, uncovered=None):
+        for line in text_log_titles(self.logfilename): yield line
+        if uncovered is not None:
+            # the part before the oldest bucket comes from the log itself
+            first, uncovered_lines = uncovered
+            if aggregate == 'mean':
+                raw = text_log_range(self.logfilename, first, start, uncovered_lines)
+            else:
+                raw = aggregate_text_log(self.logfilename, first, start, uncovered_lines, aggregate)
+            for line in raw:
+                if line_time(line) is not None: yield line # not the column titles
+        for line in tier.lines(start, end, lines, aggregate):
+            yield line
+
+    def close(self):
+        for tier in self.tiers:
+            tier.close()
+
+def build_rollups(logfilename, tiers=ROLLUP_TIERS):
+    ''' (Re)builds the rollup tiers of an existing text log. '''
+    rollups = RollupPyramid(logfilename, tiers, rebuild=True)
+    with open(logfilename, 'r') as f:
+        for line in f:
+            row = parse_text_line(line)
+            if row is not None: rollups.add(*row)
+    return rollups
+
+### ------ Compressed logs ------
+### A compressed log only keeps, for every gauge on its own, the points needed
+### to rebuild the series by linear interpolation of log10(pressure) within
+### an error bound (in decades) of the gauge (swinging door compression,
+### the rounding of the stored values adds less than 1e-5 decades).
+### After the column titles, there is one line per kept point:
+###   "time, gauge (1 ... 6), pressure"
+### An empty pressure means the gauge has no valid value from this time on.
+
+COMPRESSION_ERROR = 0.005 # decades, about 1.2 %
+
+class SwingingDoor(object):
+    ''' Swinging door compression of a single series of (time, value).
+A point is only dropped if the line between the kept points around it
+passes within error of it. add() returns the points to keep,
+NaN values interrupt the series.
+If max_interval is given, a point is kept at least every max_interval seconds. '''
+    def __init__(self, error, max_interval=None):
+        self.error = error
+        self.max_interval = max_interval
+        self.anchor = None # the last point kept
+        self.last = None # the last point added after the anchor
+        self.invalid = False
+
+    def add(self, t, y):
+        if y != y: # NaN
+            kept = [] if self.invalid else [self.last] if self.last is not None else []
+            if not self.invalid: kept.append((t, float('nan')))
+            self.anchor, self.last, self.invalid = None, None, True
+            return kept
+        if self.anchor is None:
+            self.anchor, self.last, self.invalid = (t, y), None, False
+            return [self.anchor]
+        if t <= self.anchor[0]: return []
+        kept = []
+        if self.last is not None and self.max_interval and t - self.anchor[0] > self.max_interval:
+            kept = self.close_door()
+        ta, ya = self.anchor
+        upper, lower = (y + self.error - ya) / (t - ta), (y - self.error - ya) / (t - ta)
+        if self.last is not None:
+            upper, lower = min(self.upper, upper), max(self.lower, lower)
+        if not lower <= (y - ya) / (t - ta) <= upper:
+            # the line to this point would leave the door of an earlier one:
+            # keep the last point (its line is inside all doors) and start from there
+            kept = self.close_door()
+            ta, ya = self.anchor
+            upper, lower = (y + self.error - ya) / (t - ta), (y - self.error - ya) / (t - ta)
+        self.upper, self.lower = upper, lower
+        self.last = (t, y)
+        return kept
+
+    def close_door(self):
+        self.anchor, self.last = self.last, None
+        return [self.anchor]
+
+    def finish(self):
+        ''' Returns the last point, which has not been kept yet '''
+        return self.close_door() if self.last is not None else []
+
+class CompressedLogWriter(object):
+    ''' Writes a swinging door compressed log with the methods of BinaryLogWriter.
+errors is the error bound in decades, the same for all gauges or a list of six.
+Points not kept yet are written on close() or after max_interval seconds at the latest. '''
+    def __init__(self, filename, errors=COMPRESSION_ERROR, max_interval=3600.):
+        if not isinstance(errors, (list, tuple)): errors = [errors] * 6
+        self.filename = filename
+        self.doors = [SwingingDoor(error, max_interval) for error in errors]
+        self.logfile = open(filename, 'a')
+        if self.logfile.tell() == 0: self.logfile.write("Seconds, Gauge, Pressure\n")
+
+    def write(self, logtime, logvalues, statuses=None):
+        lines = []
+        for i, val in enumerate(logvalues):
+            y = math.log10(val) if val > 0 else float('nan') # also NaN for NaN
+            lines += [format_compressed_line(t, i + 1, y) for t, y in self.doors[i].add(logtime, y)]
+        if lines: self.logfile.write(''.join(lines))
+
+    def flush(self):
+        self.logfile.flush()
+
+    def sync(self):
+        self.logfile.flush()
+        os.fsync(self.logfile.fileno())
+
+    def close(self):
+        for i, door in enumerate(self.doors):
+            self.logfile.write(''.join([format_compressed_line(t, i + 1, y) for t, y in door.finish()]))
+        self.logfile.close()
+
+def format_compressed_line(t, gauge, y):
+    return "%.3f, %d, %s\n" % (t, gauge, "%.5E" % 10**y if not math.isnan(y) else '')
+
+def read_compressed_log(filename):
+    ''' Returns the kept points of every gauge as a list of six pairs
+of arrays (time, log10 of the pressure, NaN for the interruptions). '''
+    import numpy
+    points = [([], []) for i in range(6)]
+    with open(filename, 'r') as f:
+        for line in f:
+            fields = line.split(',')
+            try:
+                t, gauge = float(fields[0]), int(fields[1])
+                y = math.log10(float(fields[2])) if fields[2].strip() else float('nan')
+            except (ValueError, IndexError):
+                continue # e.g. the column titles
+            points[gauge - 1][0].append(t)
+            points[gauge - 1][1].append(y)
+    return [(numpy.array(times), numpy.array(values)) for times, values in points]
+
+def reconstruct_compressed_log(filename, times):
+    ''' The pressures of the six gauges at the given times, shape (len(times), 6).
+NaN where a gauge had no valid value (or outside of the logged time). '''
+    return interpolate_points(read_compressed_log(filename), times)
+
+def interpolate_points(points, times):
+    ''' reconstruct_compressed_log() from the points returned by read_compressed_log() '''
+    import numpy
+    times = numpy.asarray(times, dtype=float)
+    pressures = numpy.full((len(times), 6), numpy.nan)
+    for i, (t, y) in enumerate(points):
+        if len(t) == 0: continue
+        valid = ~numpy.isnan(y)
+        if not valid.any(): continue
+        values = numpy.interp(times, t[valid], y[valid], left=numpy.nan, right=numpy.nan)
+        # no interpolation into, across or out of the interruptions
+        k = numpy.searchsorted(t, times, side='right') - 1
+        before = numpy.clip(k, 0, len(t) - 1)
+        after = numpy.clip(k + 1, 0, len(t) - 1)
+        gap = (k < 0) | numpy.isnan(y[before]) | ((k + 1 < len(t)) & numpy.isnan(y[after]) & (times > t[before]))
+        values[gap] = numpy.nan
+        pressures[:, i] = 10**values
+    return pressures
+
+def compressed_log_lines(filename, start=None, end=None, step=1.):
+    ''' Yields the reconstructed series every step seconds in [start, end)
+as lines of the text log (bytes, starting with column titles). '''
+    import numpy
+    points = read_compressed_log(filename)
+    if start is None or end is None:
+        kept = numpy.concatenate([t for t, y in points])
+        if len(kept) == 0: return
+        if start is None: start = kept.min()
+        if end is None: end = kept.max() + step
+    yield b"Seconds, " + ', '.join(["Gauge %d" % (i+1) for i in range(6)]).encode('latin-1') + b'\n'
+    times = numpy.arange(start, end, step)
+    for block in range(0, len(times), 10000):
+        chunk = times[block:block + 10000]
+        pressures = interpolate_points(points, chunk)
+        yield ''.join([format_text_line(t, row) + '\n' for t, row in zip(chunk, pressures)]).encode('latin-1')
+
+def compress_text_log(textfilename, compressedfilename, errors=COMPRESSION_ERROR):
+    ''' Compresses a text measurement log, returns the number of lines read. '''
+    writer = CompressedLogWriter(compressedfilename, errors, max_interval=None)
+    count = 0
+    with open(textfilename, 'r') as f:
+        for line in f:
+            row = parse_text_line(line)
+            if row is None: continue
+            writer.write(row[0], row[1])
+            count += 1
+    writer.close()
+    return count
@@ -28,17 +28,46 @@
 import serial
 import time
 import signal
+import warnings
 import math
+import threading
+
+## A clock that can't jump (Python 3.3+), used for the polling schedule
+monotonic = getattr(time, 'monotonic', time.time)
 
 class MaxiGauge (object):
-    def __init__(self, serialPort, baud=9600, debug=False):
+    def __init__(self, serialPort, baud=9600, debug=False, reprobe_interval=30.):
         self.debug=debug
+        ## Sensors reporting 'Sensor off' or 'No sensor' are only polled again after reprobe_interval seconds
+        self.reprobe_interval = reprobe_interval
+        self.latest_readings = [None] * 6
+        self.read_at = [None] * 6 # monotonic time of the latest readings
+        self.skip_until = [0.] * 6
+        ## send() holds the lock for a whole transaction, so threads sharing the controller can't interleave
+        self.lock = threading.RLock()
+        self.in_flight = {} # sensor -> SharedRead of the pressure being read
+        self.in_flight_lock = threading.Lock()
+        self.connect(serialPort, baud)
+        #self.send(C['ETX']) ### We might reset the connection first, but it doesn't really matter:
+        self.logfilename = 'measurement-data.txt'
+        self.logformat = 'text' # or 'binary' or 'compressed', see MeasurementLog.py
+        self.segment_seconds = None # e.g. 86400 to start a new segment of the text log every day (text format only)
+        self.background_logging = None # e.g. {'flush_interval': 5.} to write the log from a thread (MeasurementLog.BackgroundLogWriter)
+        self.rollups = None # a MeasurementLog.RollupPyramid updated with every logged line
+        self.update_callbacks = [] # called with the readings after every continuous update
+        self.poll_statistics = None # a PollStatistics once the continuous updates are running
+        self.adaptive_polling = None
+        self.metrics = None # a MaxiGaugeMetrics.CommandMetrics to instrument the communication
+        self.bytes_written = 0
+        self.ack_timed_out = False # set by getACQorNAK, for the metrics
+        self.config = None # a MaxiGaugeConfig.DeviceConfig caching the parameters of the device
+
+    def connect(self, serialPort, baud):
         try:
             self.connection = serial.Serial(serialPort, baudrate=baud, timeout=0.2)
         except serial.serialutil.SerialException as se:
             raise MaxiGaugeError(se)
-        #self.send(C['ETX']) ### We might reset the connection first, but it doesn't really matter:
-        self.logfilename = 'measurement-data.txt'
+        self.reader = FrameReader(self.connection)
 
     def checkDevice(self):
         message = "The Display Contrast is currently set to %d (out of 20).\n" % self.displayContrast()
@@ -59,11 +88,50 @@ class MaxiGauge (object):
         if newContrast == -1: return int(self.send('DCC',1)[0])
         else: return int(self.send('DCC,%d' % (newContrast,) ,1)[0])
 
-    def pressures(self):
-        return [self.pressure(i+1) for i in range(6)]
-
-    def pressure(self, sensor):
+    def sensorStatus(self):
+        ''' Returns the SEN status of the six sensors: 0 = no sensor, 1 = off, 2 = on (p.86) '''
+        return [int(status) for status in self.send('SEN',1)[0].split(',')]
+
+    def detectSensors(self):
+        ''' Learn the active sensors from SEN so that pressures() skips the others '''
+        now = time.time()
+        for i, status in enumerate(self.sensorStatus()):
+            if status == 2:
+                self.skip_until[i] = 0.
+            else:
+                self.latest_readings[i] = PressureReading(i+1, 5 if status == 0 else 4, 0.)
+                self.skip_until[i] = now + self.reprobe_interval
+        return [i+1 for i in range(6) if self.skip_until[i] <= now]
+
+    def pressures(self, max_age=None):
+        now = time.time()
+        return [self.latest_readings[i] if now < self.skip_until[i] else self.pressure(i+1, max_age) for i in range(6)]
+
+    def pressure(self, sensor, max_age=None):
+        ''' Reads the pressure of a sensor. With max_age, a reading not older than
+max_age seconds is returned from the cache instead. Threads asking for the
+same sensor while it is being read wait for that reading. '''
         if sensor < 1 or sensor >6: raise MaxiGaugeError('Sensor can only be between 1 and 6. You choose ' + str(sensor))
+        if max_age is not None:
+            reading, read_at = self.latest_readings[sensor-1], self.read_at[sensor-1]
+            if read_at is not None and monotonic() - read_at <= max_age: return reading
+        with self.in_flight_lock:
+            shared = self.in_flight.get(sensor)
+            leading = shared is None
+            if leading: shared = self.in_flight[sensor] = SharedRead()
+        if not leading: return shared.result()
+        try:
+            shared.reading = self.read_pressure(sensor)
+        except Exception as e:
+            shared.error = e
+            raise
+        finally:
+            with self.in_flight_lock:
+                del self.in_flight[sensor]
+            shared.done.set()
+        return shared.reading
+
+    def read_pressure(self, sensor):
         reading = self.send('PR%d' % sensor, 1)  ## reading will have the form x,x.xxxEsx <CR><LF> (see p.88)
         try:
             r = reading[0].split(',')
@@ -71,18 +139,27 @@ class MaxiGauge (object):
             pressure = float(r[-1])
         except:
             raise MaxiGaugeError("Problem interpreting the returned line:\n%s" % reading)
-        return PressureReading(sensor, status, pressure)
+        reading = PressureReading(sensor, status, pressure)
+        self.latest_readings[sensor-1] = reading
+        self.read_at[sensor-1] = monotonic()
+        if status in [4,5]: self.skip_until[sensor-1] = time.time() + self.reprobe_interval
+        else: self.skip_until[sensor-1] = 0.
+        return reading
 
     def signal_handler(self, sig, frame):
         self.stopping_continuous_update.set()
         signal.signal(signal.SIGINT, signal.SIG_DFL)
 
-    def start_continuous_pressure_updates(self, update_time, log_every = 0):
+    def start_continuous_pressure_updates(self, update_time, log_every = 0, max_update_time = None):
+        ''' Polls the pressures every update_time seconds.
+With max_update_time, the period adapts between update_time (while the pressures
+change) and max_update_time (while they are stable), see AdaptivePolling. '''
         from threading import Thread, Event
         self.stopping_continuous_update =  Event()
         signal.signal(signal.SIGINT, self.signal_handler)
         self.update_time = update_time
         self.log_every = log_every
+        self.adaptive_polling = AdaptivePolling(update_time, max_update_time) if max_update_time else None
         self.update_counter = 1
         self.t = Thread(target = self.continuous_pressure_updates)
         self.t.daemon = True
@@ -111,26 +188,43 @@ class MaxiGauge (object):
         #self.history = history
         #log = None
         #f.close()
-        cache = []
+        if self.log_every > 0:
+            from SampleBuffer import WindowAggregator
+            self.aggregator = WindowAggregator(self.log_every)
+        self.poll_statistics = PollStatistics(self.update_time)
+        next_deadline = monotonic()
         while not self.stopping_continuous_update.isSet():
-            startTime = time.time()
+            self.poll_statistics.cycle_started(monotonic() - next_deadline)
             self.update_counter += 1
-            self.cached_pressures = self.pressures()
-            cache.append([time.time()] + [sensor.pressure if sensor.status in [0,1,2] else float('nan') for sensor in self.cached_pressures] )
-            if self.log_every > 0 and (self.update_counter%self.log_every == 0):
-                logtime = cache[self.log_every/2][0]
-                cache = zip(*cache) # transpose cache
-                cache = cache[1:] # remove first element
-                avgs = [(sum(vals)/self.log_every) for vals in cache]
-                self.log_to_file(logtime=logtime, logvalues=avgs)
-                cache = []
-            time.sleep(0.1) # we want a minimum pause of 0.1 s
-            while not self.stopping_continuous_update.isSet() and (self.update_time - (time.time()-startTime) > .2):
-                time.sleep(.2)
-            time.sleep(max([0., self.update_time - (time.time()-startTime)]))
+            try:
+                readings = self.pressures()
+                self.cached_pressures = readings
+                for callback in self.update_callbacks: callback(readings)
+            except MaxiGaugeError as e:
+                # a timeout or a garbled answer only costs this cycle
+                self.poll_statistics.cycle_failed(e)
+                self.debugMessage(e)
+                readings = None
+            if readings is not None and self.log_every > 0:
+                # log the mean of every log_every samples (at the time of the middle one)
+                window = self.aggregator.add(time.time(), [sensor.pressure if sensor.status in [0,1,2] else float('nan') for sensor in readings])
+                if window is not None: self.log_to_file(logtime=window.time, logvalues=window.mean)
+            if self.metrics is not None: self.metrics.cycle(monotonic() - self.poll_statistics.last_start)
+            if readings is not None and self.adaptive_polling is not None:
+                self.poll_statistics.period = self.adaptive_polling.update(readings)
+            period = self.poll_statistics.period
+            # every deadline follows from the last one, so the period does not drift
+            next_deadline += period
+            now = monotonic()
+            if now > next_deadline:
+                # the cycle took longer than the period: skip the deadlines already missed
+                missed = int((now - next_deadline) // period) + 1 if period > 0 else 0
+                self.poll_statistics.overruns += missed
+                next_deadline += missed * period
+            self.stopping_continuous_update.wait(max(0., next_deadline - now))
         #sys.stderr.write(line)
-        if self.log_every > 0 and (self.update_counter%self.log_every == 0):
-            self.flush_logfile()
+        if self.log_every > 0:
+            self.close_logfile()
         #from thread import interrupt_main
         #interrupt_main()
 
@@ -139,16 +233,43 @@ class MaxiGauge (object):
         try:
             self.logfile
         except:
-            self.logfile = file(self.logfilename, 'a')
+            self.logfile = self.open_logfile()
         if not logtime:
             logtime = time.time()
         if not logvalues:
             logvalues = [sensor.pressure if sensor.status in [0,1,2] else float('nan') for sensor in self.cached_pressures]
-        line = "%d, " % logtime + ', '.join(["%.3E" % val if not math.isnan(val) else '' for val in logvalues])
-        self.logfile.write(line+'\n')
+        statuses = [sensor.status for sensor in self.cached_pressures] if hasattr(self, 'cached_pressures') else None
+        # in the background the rollups are updated by the writer thread
+        if self.rollups and self.background_logging is None: self.rollups.add(logtime, logvalues)
+        self.logfile.write(logtime, logvalues, statuses)
         #self.history.append([int(time.time())] + [sensor.pressure if sensor.status in [0,1,2] else None for sensor in self.cached_pressures])
         #self.flush_logfile()
 
+    def open_logfile(self):
+        from MeasurementLog import BinaryLogWriter, TextLogWriter, CompressedLogWriter, BackgroundLogWriter
+        if self.segment_seconds and self.logformat != 'text':
+            # only the text log (and its readers) know about segments
+            warnings.warn("segment_seconds is ignored for the %s log format, %s is written as a single file" % (self.logformat, self.logfilename))
+        if self.logformat == 'binary':
+            writer = BinaryLogWriter(self.logfilename)
+        elif self.logformat == 'compressed':
+            writer = CompressedLogWriter(self.logfilename)
+        else:
+            writer = TextLogWriter(self.logfilename, self.segment_seconds)
+        self.logwriter = writer
+        if self.background_logging is None: return writer
+        return BackgroundLogWriter([writer] + ([self.rollups] if self.rollups else []), **self.background_logging)
+
+    def close_logfile(self):
+        ''' Writes what is still queued and closes the log file (it is opened again when needed) '''
+        try:
+            logfile = self.logfile
+        except AttributeError:
+            return
+        del self.logfile
+        logfile.close()
+        if logfile is not self.logwriter: self.logwriter.close()
+
     def flush_logfile(self):
         try:
             self.logfile.flush()
@@ -159,51 +280,86 @@ class MaxiGauge (object):
         if self.debug: print(repr(message))
 
     def send(self, mnemonic, numEnquiries = 0):
+        with self.lock:
+            try:
+                if self.metrics is None: return self.transaction(mnemonic, numEnquiries)
+                return self.measured_transaction(mnemonic, numEnquiries)
+            except (serial.SerialException, IOError, OSError) as e:
+                # e.g. the USB serial adapter was unplugged, the poll loop carries on
+                raise MaxiGaugeError('Communication with the MaxiGauge failed: %s' % e)
+
+    def measured_transaction(self, mnemonic, numEnquiries):
+        ''' transaction() counting the command, its duration, NAKs and timeouts in self.metrics '''
+        start = monotonic()
+        self.ack_timed_out = False
+        try:
+            response = self.transaction(mnemonic, numEnquiries)
+            # a missing ACK is a timeout too, but only counted once per command
+            if self.ack_timed_out: self.metrics.timeout(mnemonic)
+            return response
+        except MaxiGaugeNAK:
+            self.metrics.nak(mnemonic)
+            raise
+        except MaxiGaugeTimeout:
+            self.metrics.timeout(mnemonic)
+            raise
+        finally:
+            self.metrics.command(mnemonic, monotonic() - start)
+
+    def transaction(self, mnemonic, numEnquiries):
         self.connection.flushInput()
+        self.reader.clear()
         self.write(mnemonic+LINE_TERMINATION)
         #if mnemonic != C['ETX']: self.read()
         #self.read()
-        self.getACQorNAK()
+        self.getACQorNAK(mnemonic)
         response = []
         for i in range(numEnquiries):
             self.enquire()
             response.append(self.read())
+        # a mnemonic followed by values changes the parameter
+        if self.config is not None and ',' in mnemonic: self.config.invalidate(mnemonic.split(',', 1)[0])
         return response
 
     def write(self,what):
         self.debugMessage(what)
+        if not isinstance(what, bytes): what = what.encode('latin-1')
         self.connection.write(what)
+        self.bytes_written += len(what)
 
     def enquire(self):
         self.write(C['ENQ'])
 
     def read(self):
-        data = ""
-        while True:
-            x = self.connection.read()
-            self.debugMessage(x)
-            data += x
-            if len(data)>1 and data[-2:]==LINE_TERMINATION:
-                break
-        return data[:-len(LINE_TERMINATION)]
-
-    def getACQorNAK(self):
-        returncode = self.connection.readline()
+        frame = self.reader.read_frame()
+        self.debugMessage(frame)
+        if frame is None: raise MaxiGaugeTimeout('Timeout while waiting for a response from the MaxiGauge.')
+        return frame
+
+    def getACQorNAK(self, mnemonic=''):
+        returncode = self.reader.read_frame()
         self.debugMessage(returncode)
+        if returncode is None:
+            self.ack_timed_out = True # counted by send()
+            returncode = ''
+        elif len(returncode)<1 and self.metrics is not None: self.metrics.short_ack()
         ## The following is usually expected but our MaxiGauge controller sometimes forgets this parameter... That seems to be a bug with the DCC command.
-        #if len(returncode)<3: raise MaxiGaugeError('Only received a line termination from MaxiGauge. Was expecting ACQ or NAK.')
-        if len(returncode)<3: self.debugMessage('Only received a line termination from MaxiGauge. Was expecting ACQ or NAK.')
-        if len(returncode)>2 and returncode[-3] == C['NAK']:
+        #if len(returncode)<1: raise MaxiGaugeError('Only received a line termination from MaxiGauge. Was expecting ACQ or NAK.')
+        if len(returncode)<1: self.debugMessage('Only received a line termination from MaxiGauge. Was expecting ACQ or NAK.')
+        if len(returncode)>0 and returncode[-1] == C['NAK']:
             self.enquire()
             returnedError = self.read()
             error = str(returnedError).split(',' , 1)
-            print repr(error)
-            errmsg = { 'System Error': ERR_CODES[0][int(error[0])] , 'Gauge Error': ERR_CODES[1][int(error[1])] }
+            self.debugMessage(error)
+            try:
+                errmsg = { 'System Error': ERR_CODES[0][int(error[0])] , 'Gauge Error': ERR_CODES[1][int(error[1])] }
+            except:
+                raise MaxiGaugeError("Problem interpreting the returned error status:\n%s" % returnedError)
             raise MaxiGaugeNAK(errmsg)
-        #if len(returncode)>2 and returncode[-3] != C['ACQ']: raise MaxiGaugeError('Expecting ACQ or NAK from MaxiGauge but neither were sent.')
-        if len(returncode)>2 and returncode[-3] != C['ACQ']: self.debugMessage('Expecting ACQ or NAK from MaxiGauge but neither were sent.')
+        #if len(returncode)>0 and returncode[-1] != C['ACQ']: raise MaxiGaugeError('Expecting ACQ or NAK from MaxiGauge but neither were sent.')
+        if len(returncode)>0 and returncode[-1] != C['ACQ']: self.debugMessage('Expecting ACQ or NAK from MaxiGauge but neither were sent.')
         # if no exception raised so far, the interface is just fine:
-        return returncode[:-(len(LINE_TERMINATION)+1)]
+        return returncode[:-1]
         
     def disconnect(self):
         try:
@@ -231,6 +387,139 @@ class PressureReading(object):
         return "Gauge #%d: Status %d (%s), Pressure: %f mbar\n" % (self.id, self.status, self.statusMsg(), self.pressure)
 
 
+class SharedRead(object):
+    ''' A pressure reading in progress, waited for by the threads asking for the same sensor '''
+    def __init__(self):
+        self.done = threading.Event()
+        self.reading = None
+        self.error = None
+
+    def result(self):
+        self.done.wait()
+        if self.error is not None: raise self.error
+        return self.reading
+
+
+class AdaptivePolling(object):
+    ''' Chooses the period of the continuous updates from the readings:
+the floor as soon as the log10 of any pressure moved by more than threshold
+(in decades) since the last change or a status changed, otherwise the
+period grows by the factor backoff every poll up to the ceiling. '''
+    def __init__(self, floor, ceiling, threshold=0.01, backoff=1.5):
+        self.floor = floor
+        self.ceiling = max(floor, ceiling)
+        self.threshold = threshold
+        self.backoff = backoff
+        self.period = floor
+        self.reference = None # (status, log10 of the pressure) of every sensor at the last change
+
+    def update(self, readings):
+        ''' Returns the period to wait after these readings '''
+        current = [(sensor.status, math.log10(sensor.pressure) if sensor.status in [0,1,2] and sensor.pressure > 0 else None) for sensor in readings]
+        changed = self.reference is None or len(current) != len(self.reference)
+        if not changed:
+            for (status, value), (last_status, last_value) in zip(current, self.reference):
+                if status != last_status or (value is not None and last_value is not None and abs(value - last_value) > self.threshold):
+                    changed = True
+                    break
+        if changed: self.reference = current
+        self.period = self.floor if changed else min(self.ceiling, self.period * self.backoff)
+        return self.period
+
+
+class PollStatistics(object):
+    ''' Timing of the continuous pressure updates.
+jitter is how late a cycle started with respect to its deadline,
+overruns counts the deadlines skipped because a cycle took longer than the period,
+failures the cycles that ended with a MaxiGaugeError (the latest in last_error).
+'''
+    def __init__(self, period):
+        self.period = period
+        self.cycles = 0
+        self.overruns = 0
+        self.failures = 0
+        self.last_error = None
+        self.first_start = None
+        self.last_start = None
+        self.last_jitter = 0.
+        self.max_jitter = 0.
+        self.total_jitter = 0.
+
+    def cycle_started(self, jitter):
+        self.last_start = monotonic()
+        if self.first_start is None: self.first_start = self.last_start
+        self.cycles += 1
+        self.last_jitter = jitter
+        self.max_jitter = max(self.max_jitter, jitter)
+        self.total_jitter += jitter
+
+    def cycle_failed(self, error):
+        self.failures += 1
+        self.last_error = str(error)
+
+    def rate(self):
+        ''' achieved number of cycles per second '''
+        if self.cycles < 2 or self.last_start == self.first_start: return 0.
+        return (self.cycles - 1) / (self.last_start - self.first_start)
+
+    def as_dict(self):
+        return {
+          'period': self.period,
+          'rate': self.rate(),
+          'cycles': self.cycles,
+          'overruns': self.overruns,
+          'failures': self.failures,
+          'last_error': self.last_error,
+          'last_jitter': self.last_jitter,
+          'mean_jitter': self.total_jitter / self.cycles if self.cycles else 0.,
+          'max_jitter': self.max_jitter,
+        }
+
+    def __repr__(self):
+        return "%(cycles)d cycles at %(rate).3f/s (period %(period).3f s), %(overruns)d overruns, %(failures)d failures, jitter: last %(last_jitter).4f s, mean %(mean_jitter).4f s, max %(max_jitter).4f s" % self.as_dict()
+
+
+class FrameReader(object):
+    ''' Buffered reader for the responses of the MaxiGauge.
+It fetches everything the serial port has waiting in one call,
+splits CR/LF terminated frames off an internal buffer and keeps
+the leftover bytes for the next frame.
+'''
+    def __init__(self, connection, terminator=None):
+        self.connection = connection
+        if terminator is None: terminator = LINE_TERMINATION
+        self.terminator = terminator.encode('latin-1')
+        self.buffer = bytearray()
+        self.reads = 0
+        self.bytes_read = 0
+
+    def clear(self):
+        del self.buffer[:]
+
+    def fill(self):
+        ''' Read everything the serial port has waiting (blocking for at least
+one byte) and append it to the buffer.
+Returns the number of bytes read, 0 means the port timed out. '''
+        chunk = self.connection.read(max(1, self.connection.inWaiting()))
+        self.reads += 1
+        self.bytes_read += len(chunk)
+        self.buffer += chunk
+        return len(chunk)
+
+    def read_frame(self):
+        ''' Return the next frame without its line termination
+or None if the serial port timed out before a frame was complete. '''
+        start = 0
+        while True:
+            end = self.buffer.find(self.terminator, start)
+            if end >= 0:
+                frame = bytes(self.buffer[:end])
+                del self.buffer[:end+len(self.terminator)]
+                return frame if isinstance(frame, str) else frame.decode('latin-1')
+            start = max(0, len(self.buffer) - len(self.terminator) + 1)
+            if not self.fill(): return None
+
+
 ### ------ now we define the exceptions that could occur ------
 
 class MaxiGaugeError(Exception):
@@ -239,6 +528,9 @@ class MaxiGaugeError(Exception):
 class MaxiGaugeNAK(MaxiGaugeError):
     pass
 
+class MaxiGaugeTimeout(MaxiGaugeError):
+    pass
+
 ### ------- Control Symbols as defined on p. 81 of the english
 ###        manual for the Pfeiffer Vacuum TPG256A  -----------
 C = { 
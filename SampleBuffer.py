@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- encoding: UTF8 -*-
+
+# This file is part of PfeifferVacuum.py.
+#
+# PfeifferVacuum.py is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PfeifferVacuum.py is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PfeifferVacuum.py. If not, see <http://www.gnu.org/licenses/>.
+
+
+### In-memory helpers for the stream of pressure readings.
+###
+### An in-memory ring buffer of the most recent pressure readings.
+### All storage is preallocated in flat arrays (time stamps, six pressures
+### and six status codes per sample), so appending a sample never allocates.
+### Register it with a MaxiGauge doing continuous updates:
+###
+###   recent = SampleRingBuffer(36000)
+###   mg.update_callbacks.append(recent.append)
+
+import time
+import math
+import threading
+from array import array
+from collections import namedtuple
+
+class SampleRingBuffer(object):
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.times = array('d', [0.]) * capacity
+        self.pressures = array('d', [0.]) * (6 * capacity)
+        self.statuses = array('B', [0]) * (6 * capacity)
+        self.count = 0
+        self.head = 0 # where the next sample goes
+        self.lock = threading.Lock()
+
+    def append(self, readings, logtime=None):
+        if logtime is None: logtime = time.time()
+        with self.lock:
+            i = self.head
+            self.times[i] = logtime
+            for j, sensor in enumerate(readings):
+                self.pressures[6*i + j] = sensor.pressure
+                self.statuses[6*i + j] = sensor.status
+            self.head = (i + 1) % self.capacity
+            self.count = min(self.count + 1, self.capacity)
+
+    def __len__(self):
+        return self.count
+
+    def index(self, k):
+        ''' array index of the kth oldest sample '''
+        return (self.head - self.count + k) % self.capacity
+
+    def bisect(self, t):
+        ''' number of samples older than t (the samples are ordered by time) '''
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.times[self.index(mid)] < t: lo = mid + 1
+            else: hi = mid
+        return lo
+
+    def samples(self, start, stop):
+        ''' Copies of the times, pressures and statuses of the samples in [start, stop) '''
+        with self.lock:
+            first, last = self.bisect(start), self.bisect(stop)
+            if first >= last: return array('d'), array('d'), array('B')
+            i, k = self.index(first), self.index(last - 1) + 1
+            if i < k: return self.times[i:k], self.pressures[6*i:6*k], self.statuses[6*i:6*k]
+            # the range wraps around the end of the arrays
+            return (self.times[i:] + self.times[:k], self.pressures[6*i:] + self.pressures[:6*k],
+                    self.statuses[6*i:] + self.statuses[:6*k])
+
+    def window(self, start, stop, step):
+        ''' Resamples the samples in [start, stop) to steps of `step` seconds.
+Returns the list of step start times and a list of six lists holding the
+mean of the valid readings (status 0, 1 or 2) per step or None. '''
+        steps = max(0, int((stop - start) // step))
+        totals = [[0.] * steps for j in range(6)]
+        counts = [[0] * steps for j in range(6)]
+        # the poll thread only waits for the copy, not for the resampling
+        times, pressures, statuses = self.samples(start, start + steps * step)
+        for i, t in enumerate(times):
+            n = int((t - start) // step)
+            if n >= steps: break
+            for j in range(6):
+                if statuses[6*i + j] in (0, 1, 2):
+                    totals[j][n] += pressures[6*i + j]
+                    counts[j][n] += 1
+        values = [[total / count if count else None for total, count in zip(totals[j], counts[j])] for j in range(6)]
+        return [start + n * step for n in range(steps)], values
+
+
+### Aggregation of consecutive samples into windows of a fixed number of
+### samples, as done for the log file with MaxiGauge's log_every.
+### Every sample only updates running sums and extrema (NaN values are
+### left out), so memory use and cost per sample do not depend on the
+### window length:
+###
+###   windows = WindowAggregators([75, 750], handle_window)
+###   mg.update_callbacks.append(windows.add_readings)
+
+## time is the time of the middle sample, the other fields hold one value per column,
+## count is the number of valid (not NaN) values, mean, min, max and std are NaN without any
+WindowStats = namedtuple('WindowStats', 'time samples count mean min max std')
+
+class WindowAggregator(object):
+    def __init__(self, length, columns=6):
+        if length < 1: raise ValueError('A window needs at least one sample')
+        self.length = length
+        self.columns = columns
+        self.count = [0] * columns
+        self.mean = [0.] * columns
+        self.m2 = [0.] * columns # sum of the squared differences to the mean
+        self.minimum = [0.] * columns
+        self.maximum = [0.] * columns
+        self.reset()
+
+    def reset(self):
+        self.samples = 0
+        self.time = None
+        for j in range(self.columns):
+            self.count[j] = 0
+            self.mean[j] = 0.
+            self.m2[j] = 0.
+            self.minimum[j] = float('inf')
+            self.maximum[j] = float('-inf')
+
+    def add(self, logtime, values):
+        ''' Adds a sample; returns the WindowStats if it completed the window, else None '''
+        self.samples += 1
+        if self.samples == self.length // 2 + 1: self.time = logtime
+        for j, value in enumerate(values):
+            if value != value: continue # NaN
+            n = self.count[j] + 1
+            self.count[j] = n
+            delta = value - self.mean[j]
+            self.mean[j] += delta / n
+            self.m2[j] += delta * (value - self.mean[j])
+            if value < self.minimum[j]: self.minimum[j] = value
+            if value > self.maximum[j]: self.maximum[j] = value
+        if self.samples < self.length: return None
+        stats = self.stats()
+        self.reset()
+        return stats
+
+    def stats(self):
+        ''' The WindowStats of the samples added so far '''
+        nan = float('nan')
+        valid = [n > 0 for n in self.count]
+        return WindowStats(
+          self.time,
+          self.samples,
+          list(self.count),
+          [m if v else nan for m, v in zip(self.mean, valid)],
+          [m if v else nan for m, v in zip(self.minimum, valid)],
+          [m if v else nan for m, v in zip(self.maximum, valid)],
+          [math.sqrt(m2 / n) if n else nan for m2, n in zip(self.m2, self.count)],
+        )
+
+class WindowAggregators(object):
+    ''' Several window lengths over the same samples.
+callback(length, stats) is called for every completed window. '''
+    def __init__(self, lengths, callback, columns=6):
+        self.aggregators = [WindowAggregator(length, columns) for length in lengths]
+        self.callback = callback
+
+    def add(self, logtime, values):
+        for aggregator in self.aggregators:
+            stats = aggregator.add(logtime, values)
+            if stats is not None: self.callback(aggregator.length, stats)
+
+    def add_readings(self, readings, logtime=None):
+        ''' add() for a list of PressureReadings (invalid readings count as NaN) '''
+        if logtime is None: logtime = time.time()
+        self.add(logtime, [sensor.pressure if sensor.status in (0, 1, 2) else float('nan') for sensor in readings])
@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+# -*- encoding: UTF8 -*-
+
+# This file is part of PfeifferVacuum.py.
+#
+# PfeifferVacuum.py is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PfeifferVacuum.py is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with PfeifferVacuum.py. If not, see <http://www.gnu.org/licenses/>.
+
+
+### Publishes the readings of a MaxiGauge to other processes through a
+### memory mapped file (in /dev/shm, so it never touches the disk).
+### One acquisition process writes, any number of processes read without
+### locking anything: a sequence counter in the header is odd while a
+### sample is being written (a seqlock), readers retry if it changed while
+### they copied the data.
+###
+###   header (32 bytes): magic 'MAXIGSHM', uint32 version, uint32 capacity, uint64 sequence, 8 bytes reserved
+###   ring of `capacity` records, the record format of the binary log (see MeasurementLog.py)
+###
+### Sample n (counted from 0) is in slot n % capacity, sequence // 2 samples have been written.
+###
+### Next to it, <path>.status.json holds the device configuration, the poll
+### statistics and the metrics of the acquisition process, rewritten every
+### few seconds (see SnapshotWriter.publish_status).
+
+import os
+import json
+import mmap
+import time
+import struct
+import tempfile
+import threading
+
+from PfeifferVacuum import PressureReading, MaxiGaugeError, monotonic
+from MeasurementLog import RECORD
+from MaxiGaugeMetrics import prometheus_text
+
+MAGIC = b'MAXIGSHM'
+VERSION = 1
+HEADER = struct.Struct('<8sIIQ8x')
+SEQUENCE = struct.Struct('<Q')
+SEQUENCE_OFFSET = 16
+
+SNAPSHOT_PATH = os.path.join('/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(), 'maxigauge-snapshot')
+
+def status_path(path):
+    return path + '.status.json'
+
+class SnapshotWriter(object):
+    ''' Writes the samples into the shared file, publish() can be used as update callback of a MaxiGauge. '''
+    def __init__(self, path=SNAPSHOT_PATH, capacity=36000):
+        self.path = path
+        self.capacity = capacity
+        self.sequence = 0
+        size = HEADER.size + capacity * RECORD.size
+        # a new file replaces the old one, readers still mapping the old one notice the new inode
+        temporary = path + '.new'
+        with open(temporary, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, capacity, 0))
+            f.truncate(size)
+        self.file = open(temporary, 'r+b')
+        self.map = mmap.mmap(self.file.fileno(), size)
+        os.rename(temporary, path)
+
+    def publish(self, readings, logtime=None):
+        if logtime is None: logtime = time.time()
+        slot = HEADER.size + (self.sequence // 2) % self.capacity * RECORD.size
+        record = RECORD.pack(*([logtime] + [sensor.pressure for sensor in readings] + [sensor.status for sensor in readings]))
+        self.sequence += 1 # odd: writing
+        SEQUENCE.pack_into(self.map, SEQUENCE_OFFSET, self.sequence)
+        self.map[slot:slot + RECORD.size] = record
+        self.sequence += 1
+        SEQUENCE.pack_into(self.map, SEQUENCE_OFFSET, self.sequence)
+
+    def publish_status(self, maxigauge):
+        ''' Writes the configuration, poll statistics and metrics of the MaxiGauge next to the snapshot '''
+        status = {
+          'time': time.time(),
+          'config': maxigauge.config.snapshot() if maxigauge.config else None,
+          'poll_statistics': maxigauge.poll_statistics.as_dict() if maxigauge.poll_statistics else None,
+          'metrics': prometheus_text(maxigauge),
+        }
+        temporary = status_path(self.path) + '.new'
+        with open(temporary, 'w') as f:
+            json.dump(status, f)
+        os.rename(temporary, status_path(self.path))
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+def unpack_record(data):
+    values = RECORD.unpack(data)
+    return values[0], [PressureReading(i+1, values[7+i], values[1+i]) for i in range(6)]
+
+class SnapshotReader(object):
+    ''' Reads the samples published by a SnapshotWriter (in any process) '''
+    def __init__(self, path=SNAPSHOT_PATH):
+        self.path = path
+        self.map = None
+        self.open()
+
+    def open(self):
+        with open(self.path, 'rb') as f:
+            self.inode = os.fstat(f.fileno()).st_ino
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.capacity, sequence = HEADER.unpack(self.map[:HEADER.size])
+        if magic != MAGIC or version != VERSION:
+            raise MaxiGaugeError('%s is no MaxiGauge snapshot (version %d)' % (self.path, VERSION))
+
+    def reopen_if_replaced(self):
+        ''' Maps the file again if the writer was restarted, returns True if it did '''
+        try:
+            if os.stat(self.path).st_ino == self.inode: return False
+        except OSError:
+            return False
+        self.map.close()
+        self.open()
+        return True
+
+    def sequence(self):
+        return SEQUENCE.unpack_from(self.map, SEQUENCE_OFFSET)[0]
+
+    def stable_sequence(self, timeout=.1):
+        ''' The sequence counter as soon as no sample is being written.
+If a sample stays half written for timeout seconds (the writer died while writing it),
+the counter before it: the samples published until then are still intact. '''
+        deadline = None
+        while True:
+            sequence = self.sequence()
+            if sequence % 2 == 0: return sequence
+            if deadline is None: deadline = monotonic() + timeout
+            elif monotonic() > deadline: return sequence - 1
+            time.sleep(0)
+
+    def slot(self, n):
+        offset = HEADER.size + n % self.capacity * RECORD.size
+        return self.map[offset:offset + RECORD.size]
+
+    def latest(self):
+        ''' Returns (time, readings) of the latest sample or None '''
+        while True:
+            sequence = self.stable_sequence()
+            if sequence == 0: return None
+            data = self.slot(sequence // 2 - 1)
+            # intact unless the writer got past the next sample (into the slot copied after wrapping around)
+            if self.sequence() - sequence <= 1: return unpack_record(data)
+
+    def recent(self, count=None, since=None):
+        ''' Returns [(time, readings), ...] of the last `count` samples (all in the ring by default)
+or those published after `since`, oldest first '''
+        sequence = self.stable_sequence()
+        n = sequence // 2
+        first = max(0, n - (count if count else self.capacity), n - self.capacity)
+        data = [self.slot(i) for i in range(first, n)]
+        # the slots written in the meantime (one maybe half way) no longer hold the samples copied
+        overwritten = (self.sequence() - sequence + 1) // 2
+        valid = max(first, n + overwritten - self.capacity)
+        samples = [unpack_record(record) for record in data[valid - first:]]
+        if since is not None: samples = [sample for sample in samples if sample[0] > since]
+        return samples
+
+class PublishedStatus(dict):
+    ''' A part of the published status, served like a DeviceConfig or PollStatistics '''
+    def snapshot(self):
+        return dict(self)
+
+    def as_dict(self):
+        return dict(self)
+
+class SnapshotMaxiGauge(object):
+    ''' A read-only stand-in for a MaxiGauge doing continuous updates in another process.
+The update callbacks are called by a thread watching the snapshot, with the readings
+and the time they were taken at (like SampleRingBuffer.append). '''
+    def __init__(self, path=SNAPSHOT_PATH):
+        self.snapshot = SnapshotReader(path)
+        self.update_callbacks = []
+        self.rollups = None
+        self.metrics = None
+        self.stopping = threading.Event()
+        self.status_key = None
+        self.published = {}
+
+    def status(self):
+        ''' The status published by the acquisition process ({} if there is none), read again when it changed '''
+        try:
+            stat = os.stat(status_path(self.snapshot.path))
+        except OSError:
+            return {}
+        key = (stat.st_ino, stat.st_mtime)
+        if key != self.status_key:
+            with open(status_path(self.snapshot.path)) as f:
+                self.published = json.load(f)
+            self.status_key = key
+        return self.published
+
+    @property
+    def config(self):
+        config = self.status().get('config')
+        return PublishedStatus(config) if config else None
+
+    @property
+    def poll_statistics(self):
+        statistics = self.status().get('poll_statistics')
+        return PublishedStatus(statistics) if statistics else None
+
+    def published_metrics(self):
+        return self.status().get('metrics', '')
+
+    @property
+    def cached_pressures(self):
+        sample = self.snapshot.latest()
+        if sample is None: raise MaxiGaugeError('No readings published in %s yet' % self.snapshot.path)
+        return sample[1]
+
+    def pressures(self, max_age=None):
+        return self.cached_pressures
+
+    def flush_logfile(self):
+        pass # the log is written by the acquisition process
+
+    def backfill(self, callback):
+        ''' Calls callback(readings, time) for the samples already published '''
+        for logtime, readings in self.snapshot.recent():
+            callback(readings, logtime)
+
+    def start_watching(self, interval=.1):
+        def watch():
+            last = self.snapshot.stable_sequence()
+            while not self.stopping.wait(interval):
+                if self.snapshot.reopen_if_replaced(): last = 0
+                sequence = self.snapshot.stable_sequence()
+                if sequence == last: continue
+                last = sequence
+                sample = self.snapshot.latest()
+                if sample is None: continue
+                for callback in self.update_callbacks: callback(sample[1], sample[0])
+        t = threading.Thread(target=watch)
+        t.daemon = True
+        t.start()
+
+    def disconnect(self):
+        self.stopping.set()
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+
+### Polls a MaxiGauge, writes the measurement log and publishes the readings
+### to shared memory, along with the device configuration, the poll statistics
+### and the metrics (see SharedSnapshot.py). Web servers started with
+### `snapshot` set then serve the data without opening the serial port,
+### from as many processes as needed:
+###   ./acquisition-daemon.py /dev/ttyUSB0
+
+import argparse
+parser = argparse.ArgumentParser(description='Poll a MaxiGauge and publish the readings to shared memory')
+parser.add_argument("-t", help="fastest poll period in seconds", type=float, default=.4)
+parser.add_argument("-m", "--max-update-time", help="slowest poll period in seconds (while the pressures are stable)", type=float, default=4.)
+parser.add_argument("-n", "--log-every", help="log the mean of every n readings", type=int, default=75)
+parser.add_argument("-l", "--logfile", help="text log to write", default='measurement-data.txt')
+parser.add_argument("-s", "--snapshot", help="shared memory file to publish the readings to", default=None)
+parser.add_argument("port", help="serial port of the MaxiGauge", nargs='?', default='/dev/ttyUSB0')
+args = parser.parse_args()
+
+### Load the module:
+from PfeifferVacuum import MaxiGauge
+from MeasurementLog import RollupPyramid
+from MaxiGaugeConfig import DeviceConfig
+from MaxiGaugeMetrics import CommandMetrics
+from SharedSnapshot import SnapshotWriter, SNAPSHOT_PATH
+
+mg = MaxiGauge(args.port)
+mg.logfilename = args.logfile
+mg.segment_seconds = 86400
+mg.rollups = RollupPyramid(args.logfile, writer=True)
+mg.background_logging = {'flush_interval': 5., 'fsync_interval': 60., 'overflow': 'drop'}
+mg.metrics = CommandMetrics()
+snapshot = SnapshotWriter(args.snapshot or SNAPSHOT_PATH)
+mg.update_callbacks.append(snapshot.publish)
+### The parameters are read a few at a time, after the readings were published:
+config = DeviceConfig(mg)
+mg.update_callbacks.append(config.poll)
+
+print("Publishing to %s, press Ctrl-C to stop." % snapshot.path)
+mg.start_continuous_pressure_updates(args.t, args.log_every, max_update_time=args.max_update_time)
+while mg.t.is_alive():
+    mg.t.join(1.)
+    snapshot.publish_status(mg) # the configuration, poll statistics and metrics for the web servers
+mg.rollups.close() # writes the unfinished buckets
+snapshot.close()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+### Protocol benchmark for the PfeifferVacuum module.
+### Runs MaxiGauge against the MaxiGaugeSimulator on a pseudo terminal
+### (Linux only) and reports polls per second, latency percentiles per
+### mnemonic and the CPU time spent per poll cycle.
+
+import argparse
+parser = argparse.ArgumentParser(description='Benchmark the MaxiGauge protocol implementation')
+parser.add_argument("-n", help="number of pressures() poll cycles", type=int, default=100)
+parser.add_argument("--baud", help="simulated baud rate, 0 for no transmission delay", type=int, default=9600)
+parser.add_argument("--latency", help="simulated processing time per answer in s", type=float, default=0.0)
+parser.add_argument("--jitter", help="maximum random delay per answer in s", type=float, default=0.0)
+parser.add_argument("--drop-rate", help="probability of losing a byte", type=float, default=0.0)
+parser.add_argument("--nak-rate", help="probability of a NAK answer", type=float, default=0.0)
+args = parser.parse_args()
+
+import time
+
+from PfeifferVacuum import MaxiGauge, MaxiGaugeError
+from MaxiGaugeSimulator import MaxiGaugeSimulator
+
+clock = time.process_time if hasattr(time, 'process_time') else time.clock
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values: return float('nan')
+    return values[min(len(values) - 1, int(p / 100. * len(values)))]
+
+sim = MaxiGaugeSimulator(args.baud, args.latency, args.jitter, args.drop_rate, args.nak_rate, seed=1)
+mg = MaxiGauge(sim.start())
+
+latencies = {}
+errors = {}
+def timed(mnemonic, numEnquiries=1):
+    start = time.time()
+    try:
+        mg.send(mnemonic, numEnquiries)
+    except MaxiGaugeError:
+        errors[mnemonic[:3]] = errors.get(mnemonic[:3], 0) + 1
+        return
+    latencies.setdefault(mnemonic[:3], []).append(time.time() - start)
+
+### Single commands
+for i in range(args.n):
+    for mnemonic in ['PR1', 'SEN', 'DCC', 'TKB', 'ERR', 'UNI']:
+        timed(mnemonic)
+
+### Complete poll cycles
+cycle_errors = 0
+cpu, wall = clock(), time.time()
+for i in range(args.n):
+    try:
+        mg.pressures()
+    except MaxiGaugeError:
+        cycle_errors += 1
+cpu = clock() - cpu
+wall = time.time() - wall
+
+print("Simulated link: %d baud, latency %.1f ms, jitter %.1f ms, drop rate %g, NAK rate %g" % (
+    args.baud, args.latency * 1e3, args.jitter * 1e3, args.drop_rate, args.nak_rate))
+print("")
+print("mnemonic   count  errors   p50 [ms]   p90 [ms]   p99 [ms]   max [ms]")
+for mnemonic in sorted(set(latencies) | set(errors)):
+    values = latencies.get(mnemonic, [])
+    print("%-8s %7d %7d %10.3f %10.3f %10.3f %10.3f" % (mnemonic, len(values), errors.get(mnemonic, 0),
+        percentile(values, 50) * 1e3, percentile(values, 90) * 1e3, percentile(values, 99) * 1e3,
+        (max(values) if values else float('nan')) * 1e3))
+print("")
+print("poll cycles: %d (%d failed)" % (args.n, cycle_errors))
+print("polls per second: %.2f" % (args.n / wall))
+print("CPU time per cycle: %.3f ms" % (cpu / args.n * 1e3))
+print("wall time per cycle: %.3f ms" % (wall / args.n * 1e3))
+
+mg.connection.close()
+sim.stop()
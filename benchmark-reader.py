@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+### Compares the buffered FrameReader of PfeifferVacuum.MaxiGauge with the
+### former byte by byte reader. It runs against the MaxiGaugeSimulator
+### on a pseudo terminal (Linux only), so no real device is needed.
+### It counts the calls to the serial port and the time per command.
+
+import argparse
+parser = argparse.ArgumentParser(description='Benchmark the MaxiGauge response reader')
+parser.add_argument("-n", help="number of pressures() polls per reader", type=int, default=200)
+args = parser.parse_args()
+
+import time
+
+from PfeifferVacuum import MaxiGauge, LINE_TERMINATION
+from MaxiGaugeSimulator import MaxiGaugeSimulator
+
+class CountingConnection(object):
+    ''' Wraps a serial.Serial instance and counts the calls reaching the port. '''
+    def __init__(self, connection):
+        self.connection = connection
+        self.calls = 0
+    def __getattr__(self, name):
+        attr = getattr(self.connection, name)
+        if name in ('read', 'readline', 'write', 'inWaiting'):
+            def counted(*args, **kwargs):
+                self.calls += 1
+                return attr(*args, **kwargs)
+            return counted
+        return attr
+
+class LegacyMaxiGauge(MaxiGauge):
+    ''' The reader as it was before the FrameReader was introduced. '''
+    def read(self):
+        data = b''
+        while True:
+            x = self.connection.read()
+            data += x
+            if len(data)>1 and data[-2:]==LINE_TERMINATION.encode():
+                break
+        return data[:-len(LINE_TERMINATION)].decode('latin-1')
+
+    def getACQorNAK(self, mnemonic=''):
+        returncode = self.connection.readline()
+        return returncode[:-(len(LINE_TERMINATION)+1)]
+
+clock = time.process_time if hasattr(time, 'process_time') else time.clock
+
+def run(cls):
+    sim = MaxiGaugeSimulator(baud=0)
+    mg = cls(sim.start())
+    mg.connection = mg.reader.connection = CountingConnection(mg.connection)
+    cpu, wall = clock(), time.time()
+    for i in range(args.n):
+        mg.pressures()
+    cpu = clock() - cpu
+    wall = time.time() - wall
+    commands = args.n * 6
+    print("%-16s %8.1f port calls/command  %8.1f us/command  %8.1f us CPU/command" % (cls.__name__,
+        float(mg.connection.calls) / commands, wall / commands * 1e6, cpu / commands * 1e6))
+    mg.connection.close()
+    sim.stop()
+
+run(LegacyMaxiGauge)
+run(MaxiGauge)
@@ -0,0 +1,18 @@
+#!/usr/bin/env python
+
+### (Re)builds the rollup tiers (10 s, 1 min, 10 min and 1 h buckets with
+### count, mean, min and max of every gauge) of an existing text log.
+### Run it while the logger is stopped, afterwards the logger keeps the
+### tiers up to date. The last, incomplete bucket of every tier is dropped.
+
+import argparse
+parser = argparse.ArgumentParser(description='Build the rollup tiers of a measurement log')
+parser.add_argument("filename", help="text log, e.g. measurement-data.txt", nargs='?', default='measurement-data.txt')
+args = parser.parse_args()
+
+from MeasurementLog import build_rollups
+
+rollups = build_rollups(args.filename)
+for tier in rollups.tiers:
+    print("wrote %s" % tier.filename)
+rollups.close()
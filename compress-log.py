@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+
+### Compresses a text measurement log (measurement-data.txt) into the
+### swinging door compressed format described in MeasurementLog.py, or,
+### with -x, rebuilds the series of a compressed log as a text log:
+###   ./compress-log.py -e 0.005 measurement-data.txt measurement-data.sdt.txt
+###   ./compress-log.py -x -s 30 measurement-data.sdt.txt > restored.txt
+
+import argparse
+parser = argparse.ArgumentParser(description='Compress a text measurement log or rebuild it from a compressed one')
+parser.add_argument("-e", "--error", help="error bound in decades (one value or six comma separated ones)", default='0.005')
+parser.add_argument("-x", "--extract", help="rebuild a text log from a compressed one", action='store_true')
+parser.add_argument("-s", "--step", help="time step in seconds of the rebuilt text log", type=float, default=1.)
+parser.add_argument("filenames", help="text log and compressed log to write or, with -x, the compressed log", nargs='+')
+args = parser.parse_args()
+
+import os
+import sys
+from MeasurementLog import compress_text_log, compressed_log_lines
+
+if args.extract:
+    out = getattr(sys.stdout, 'buffer', sys.stdout)
+    for lines in compressed_log_lines(args.filenames[0], step=args.step):
+        out.write(lines)
+    sys.exit(0)
+
+if len(args.filenames) != 2: parser.error("need the text log and the compressed log to write")
+errors = [float(error) for error in args.error.split(',')]
+if len(errors) == 1: errors = errors[0]
+elif len(errors) != 6: parser.error("need one or six error bounds")
+count = compress_text_log(args.filenames[0], args.filenames[1], errors)
+print("Compressed %d lines from %d to %d bytes." % (count, os.path.getsize(args.filenames[0]), os.path.getsize(args.filenames[1])))
@@ -0,0 +1,16 @@
+#!/usr/bin/env python
+
+### Converts a text measurement log (measurement-data.txt) into the
+### binary format described in MeasurementLog.py.
+### Values have no status in the text log, so they are stored as
+### 0 (Measurement data okay) or STATUS_UNKNOWN for empty fields.
+
+import argparse
+parser = argparse.ArgumentParser(description='Convert a text measurement log to the binary format')
+parser.add_argument("textfile", help="text log to read, e.g. measurement-data.txt")
+parser.add_argument("binaryfile", help="binary log to append to, e.g. measurement-data.bin")
+args = parser.parse_args()
+
+from MeasurementLog import convert_text_log
+
+print("Converted %d records." % convert_text_log(args.textfile, args.binaryfile))
@@ -0,0 +1,30 @@
+#!/usr/bin/env python
+
+### Owns the serial port of a MaxiGauge and lets several local processes
+### use it at the same time through a Unix socket (see MaxiGaugeBroker.py):
+###   ./maxigauge-broker.py /dev/ttyUSB0
+### Scripts then use MaxiGaugeBroker.MaxiGaugeClient('/dev/ttyUSB0') in place of MaxiGauge.
+
+import argparse
+parser = argparse.ArgumentParser(description='Share a MaxiGauge between local processes')
+parser.add_argument("-s", "--socket", help="Unix socket to listen on (default: derived from the serial port)", default=None)
+parser.add_argument("-i", "--interval", help="print the statistics every so many seconds (0 for never)", type=float, default=60.)
+parser.add_argument("port", help="serial port of the MaxiGauge", nargs='?', default='/dev/ttyUSB0')
+args = parser.parse_args()
+
+### Load the module:
+from PfeifferVacuum import MaxiGauge
+from MaxiGaugeBroker import MaxiGaugeBroker, socket_path
+import time
+
+broker = MaxiGaugeBroker(MaxiGauge(args.port), args.socket or socket_path(args.port))
+broker.start()
+print("Listening on %s, press Ctrl-C to stop." % broker.path)
+try:
+    while True:
+        time.sleep(args.interval or 3600.)
+        if args.interval: print("%(requests)d requests, %(transactions)d transactions, %(coalesced)d coalesced, %(queued)d queued" % broker.statistics())
+except KeyboardInterrupt:
+    pass
+finally:
+    broker.close()
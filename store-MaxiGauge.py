@@ -2,35 +2,44 @@
 
 ### Load the module:
 from PfeifferVacuum import MaxiGauge, MaxiGaugeError
+from MeasurementLog import RollupPyramid, TextLogWriter, BackgroundLogWriter
 import time
 import sys
 
 ### Initialize an instance of the MaxiGauge controller with
 ### the handle of the serial terminal it is connected to
 mg = MaxiGauge('/dev/ttyUSB1')
-logfile = file('measurement-data.txt', 'a')
+### The log file and its rollups are written by a thread, flushed every second:
+logfile = BackgroundLogWriter([TextLogWriter('measurement-data.txt'), RollupPyramid('measurement-data.txt', writer=True)], flush_interval=1.)
 
 ### Read out the pressure gauges
-while True:
-    startTime = time.time()
+try:
+    while True:
+        startTime = time.time()
 
-    try:
-        ps = mg.pressures()
-    except MaxiGaugeError, mge:
-        print mge
-        continue
-    line = "%d, " % int(time.time())
-    for sensor in ps:
-        #print sensor
-        if sensor.status in [0,1,2]:
-            line += "%.3E" % sensor.pressure
-        line += ", "
-    line = line[0:-2] # omit the last comma and space
-    print line
-    sys.stdout.flush()
-    logfile.write(line+'\n')
-    logfile.flush()
+        try:
+            ps = mg.pressures()
+        except MaxiGaugeError, mge:
+            print mge
+            continue
+        logtime = int(time.time())
+        line = "%d, " % logtime
+        for sensor in ps:
+            #print sensor
+            if sensor.status in [0,1,2]:
+                line += "%.3E" % sensor.pressure
+            line += ", "
+        line = line[0:-2] # omit the last comma and space
+        print line
+        sys.stdout.flush()
+        logfile.write(logtime, [sensor.pressure if sensor.status in [0,1,2] else float('nan') for sensor in ps], [sensor.status for sensor in ps])
 
-    # do this every second
-    endTime = time.time()-startTime
-    time.sleep(max([0.0, 1. - endTime]))
+        # do this every second
+        endTime = time.time()-startTime
+        time.sleep(max([0.0, 1. - endTime]))
+except KeyboardInterrupt:
+    pass
+finally:
+    ### Write what is still queued and the unfinished rollup buckets:
+    logfile.close()
+    for target in logfile.targets: target.close()
@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+
+### Log several MaxiGauge controllers at once with one process.
+### Every serial port gets its own log file measurement-data-<port>.txt,
+### e.g. ./store-MaxiGauges.py /dev/ttyUSB0 /dev/ttyUSB1
+
+import argparse
+parser = argparse.ArgumentParser(description='Log the pressures of several MaxiGauge controllers')
+parser.add_argument("-t", help="poll period in seconds", type=float, default=1.)
+parser.add_argument("ports", help="serial ports of the MaxiGauge controllers", nargs='+')
+args = parser.parse_args()
+
+### Load the module:
+from PfeifferVacuum import MaxiGauge
+from MaxiGaugeAcquisition import AcquisitionEngine, LogfileSink, print_sample
+import os
+import sys
+import time
+
+controllers = dict((os.path.basename(port), MaxiGauge(port)) for port in args.ports)
+logfiles = LogfileSink()
+
+def sink(sample):
+    print_sample(sample)
+    sys.stdout.flush()
+    logfiles(sample)
+
+engine = AcquisitionEngine(controllers, args.t, sink)
+engine.start()
+try:
+    while True: time.sleep(1)
+except KeyboardInterrupt:
+    engine.stop()
+    logfiles.close()
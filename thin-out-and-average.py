@@ -1,38 +1,59 @@
-#!/usr/bin/env python2.7
+#!/usr/bin/env python
+
+### Averages every n consecutive lines of a measurement log.
+### A window is restarted whenever the time stamps jump (gap or step back),
+### incomplete windows are dropped. The file is processed in large blocks
+### with NumPy, so memory use does not depend on the size of the file.
+### NaN (empty) values are ignored by the aggregation.
 
 import argparse
 parser = argparse.ArgumentParser(description='Thin out data files')
 parser.add_argument("-n", help="aggregate data and print every nth line", type=int, default=30)
+parser.add_argument("-a", "--aggregate", help="aggregation of the values in a window", choices=['mean', 'min', 'max'], default='mean')
 parser.add_argument("filename", help="File to thin out")
 args = parser.parse_args()
 
 try:
-    f = open(args.filename)
+    f = open(args.filename, 'rb')
 except:
     import sys
     sys.exit(1)
 
-import csv
-log = csv.reader(f)
+import sys
+import warnings
+import numpy
+from MeasurementLog import read_text_blocks, parse_text_block
+
+out = getattr(sys.stdout, 'buffer', sys.stdout)
 
 # Get the 1st line, assuming it contains the column titles
-fieldnames = log.next()
-print ','.join(fieldnames)
+fieldnames = f.readline()
+out.write(fieldnames)
+columns = fieldnames.count(b',') + 1
 
-import operator
-import math
-last_time = 0L
-store = []
-for row in log:
-    if len(row) != len(fieldnames): continue
-    this_time = long(row[0])
-    if this_time > last_time + 1 or this_time <= last_time:
-        store = []
-    store.append([this_time] + [float(val) if not val.strip() == '' else float('nan') for val in row[1:]])
-    if len(store) % args.n == 0:
-        tstore = zip(*store) # transpose store
-        tstore = tstore[1:] # remove first element
-        avgs = [(sum(vals)/args.n) for vals in tstore]
-        print "%d, " % store[args.n/2][0], ', '.join('%.3E' % avg if not math.isnan(avg) else '' for avg in avgs)
-        store = []
-    last_time = this_time
+aggregate = {'mean': numpy.nanmean, 'min': numpy.nanmin, 'max': numpy.nanmax}[args.aggregate]
+n = args.n
+carry = numpy.zeros((0, columns)) # the incomplete window at the end of the last block
+for lines in read_text_blocks(f):
+    block = numpy.concatenate((carry, parse_text_block(lines, columns)))
+    if len(block) == 0: continue
+    t = block[:, 0]
+    # a new window starts at every gap in time
+    starts = numpy.ones(len(t), dtype=bool)
+    starts[1:] = (t[1:] > t[:-1] + 1) | (t[1:] <= t[:-1])
+    segment = numpy.cumsum(starts) - 1
+    segment_start = numpy.flatnonzero(starts)
+    segment_length = numpy.diff(numpy.append(segment_start, len(t)))
+    position = numpy.arange(len(t)) - segment_start[segment]
+    complete = (position // n + 1) * n <= segment_length[segment]
+    # the rows of the last segment after its last complete window go on to the next block
+    last = segment_start[-1] + segment_length[-1] // n * n
+    carry = block[last:]
+    windows = block[complete].reshape(-1, n, columns)
+    if len(windows) == 0: continue
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning) # windows without any valid value
+        values = aggregate(windows[:, :, 1:], axis=1)
+    times = windows[:, n // 2, 0]
+    out.write(''.join(["%d, " % logtime + ', '.join(['%.3E' % val if not numpy.isnan(val) else '' for val in row]) + '\n'
+                       for logtime, row in zip(times, values)]).encode('latin-1'))
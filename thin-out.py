@@ -1,4 +1,8 @@
-#!/usr/bin/env python2
+#!/usr/bin/env python
+
+### Prints every nth line of a measurement log.
+### The file is read in large blocks of lines, so it streams through
+### files of any size with bounded memory.
 
 import argparse
 parser = argparse.ArgumentParser(description='Thin out data files')
@@ -7,21 +11,23 @@ parser.add_argument("filename", help="File to thin out")
 args = parser.parse_args()
 
 try:
-    f = open(args.filename)
+    f = open(args.filename, 'rb')
 except:
     import sys
     sys.exit(1)
 
-import csv
-log = csv.reader(f)
+import sys
+from MeasurementLog import read_text_blocks
+
+out = getattr(sys.stdout, 'buffer', sys.stdout)
 
 # Get the 1st line, assuming it contains the column titles
-fieldnames = log.next()
-print ','.join(fieldnames)
+fieldnames = f.readline()
+out.write(fieldnames)
+commas = fieldnames.count(b',')
 
 i = 0
-for row in log:
-    if len(row) != len(fieldnames): continue
-    if i % args.n == 0:
-        print ','.join(row)
-    i += 1
+for lines in read_text_blocks(f):
+    valid = [line for line in lines if line.count(b',') == commas]
+    out.write(b''.join(valid[(-i) % args.n::args.n]))
+    i += len(valid)
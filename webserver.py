@@ -30,12 +30,27 @@
 # When finished, run this file via `./webserver.py`
 # and you should be able to reach the site via
 # http://localhost:8080
+#
+# To serve from several processes, let `./acquisition-daemon.py` poll the
+# MaxiGauge and write the log, set `snapshot` below and run the app `root`
+# of this module with any number of workers. Every open live page keeps a
+# server-sent events stream busy, so use threaded workers, e.g.
+# `gunicorn -w 4 -k gthread --threads 50 webserver:root` (gthread needs the
+# `futures` package on Python 2); the default sync workers serve one request
+# at a time and a few live pages would block all of them.
 
 device = '/dev/ttyUSB0'
 logfilename = 'measurement-data.txt'
+segment_seconds = 86400 # a new (compressed) segment of the log every day, None for a single file
+snapshot = None # e.g. SharedSnapshot.SNAPSHOT_PATH to read the readings of acquisition-daemon.py
 
 ### Load the module:
 from PfeifferVacuum import MaxiGauge, MaxiGaugeError
+from MeasurementLog import RollupPyramid
+from SampleBuffer import SampleRingBuffer
+from MaxiGaugeMetrics import CommandMetrics, prometheus_text
+from MaxiGaugeConfig import DeviceConfig
+from SharedSnapshot import SnapshotMaxiGauge
 
 from bottle import Bottle, run, request, static_file, HTTPError, PluginError, response
 
@@ -57,6 +72,7 @@ http://bottlepy.org/docs/stable/plugindev.html#plugin-example-sqliteplugin
     def __init__(self, device, keyword='maxigauge'):
          self.device = device
          self.keyword = keyword
+         self.config = None
 
     def setup(self, app):
         ''' Make sure that other installed plugins don't affect the same
@@ -66,11 +82,31 @@ keyword argument.'''
             if other.keyword == self.keyword:
                 raise PluginError("Found another MaxiGauge plugin with "\
                 "conflicting settings (non-unique keyword).")
+        if snapshot:
+            ### The acquisition daemon polls the MaxiGauge and writes the log
+            try:
+                self.maxigauge = SnapshotMaxiGauge(snapshot)
+            except (IOError, OSError, MaxiGaugeError), e:
+                raise PluginError("Could not open the snapshot of the acquisition daemon (%s). Error: %s" % (snapshot, e) )
+            ### The daemon writes the rollup tiers, the workers only query them (never writer=True here):
+            self.maxigauge.rollups = RollupPyramid(logfilename)
+            self.maxigauge.start_watching()
+            return
         try:
             ### Initialize an instance of the MaxiGauge controller with
             ### the handle of the serial terminal it is connected to
             self.maxigauge = MaxiGauge(self.device)
-            self.maxigauge.start_continuous_pressure_updates(.4, 75)
+            self.maxigauge.logfilename = logfilename
+            self.maxigauge.segment_seconds = segment_seconds
+            ### Write the log from a thread, so a slow SD card never delays the polling:
+            self.maxigauge.background_logging = {'flush_interval': 5., 'fsync_interval': 60., 'overflow': 'drop'}
+            self.maxigauge.rollups = RollupPyramid(logfilename, writer=True)
+            self.maxigauge.metrics = CommandMetrics()
+            ### The device parameters are read a few at a time after the poll cycles
+            ### (registered below, after the callbacks feeding the live pages):
+            self.config = DeviceConfig(self.maxigauge)
+            ### Poll every 0.4 s while the pressures change, backing off to 4 s while they are stable:
+            self.maxigauge.start_continuous_pressure_updates(.4, 75, max_update_time=4.)
         except Exception, e:
             raise PluginError("Could not connect to the MaxiGauge (on port %s). Error: %s" % (self.device, e) )
 
@@ -127,17 +163,111 @@ api.install(mg_plugin)
 #
 #    return status
 
-@api.route('/pressures')
-def pressure_data(maxigauge):
+def pressure_status(ps):
     status = dict()
-    ### Read out the pressure gauges
-    #ps = maxigauge.pressures()
-    ps = maxigauge.cached_pressures
     for i, sensor in enumerate(ps):
         if sensor.status in [0,1,2]:
             status['gauge %d' % (i+1)] = sensor.pressure
     return status
 
+@api.route('/pressures')
+def pressure_data(maxigauge):
+    ### Read out the pressure gauges
+    #ps = maxigauge.pressures()
+    return pressure_status(maxigauge.cached_pressures)
+
+@api.route('/poll_statistics')
+def poll_statistics(maxigauge):
+    ''' Achieved polling rate, overruns and jitter of the continuous updates '''
+    if not maxigauge.poll_statistics: raise HTTPError(503, "No continuous updates running")
+    return maxigauge.poll_statistics.as_dict()
+
+@api.route('/config')
+def config(maxigauge):
+    ''' The cached parameters of the MaxiGauge (names, unit, filters, set points, ...) '''
+    if not maxigauge.config: raise HTTPError(503, "The configuration has not been read yet")
+    return maxigauge.config.snapshot()
+
+@api.route('/metrics')
+def metrics(maxigauge):
+    ''' Command latencies, error counters and poll timing for Prometheus '''
+    response.content_type = 'text/plain; version=0.0.4'
+    return prometheus_text(maxigauge)
+
+import threading
+class PressureBroadcaster(object):
+    ''' Serializes every new sample of the acquisition thread once as a
+server-sent event and hands it to all streaming clients. A client always
+gets the latest event, so a slow client skips samples instead of
+piling them up or holding back the acquisition. '''
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.sequence = 0
+        self.event = None
+
+    def publish(self, ps, logtime=None):
+        status = pressure_status(ps)
+        status['time'] = logtime if logtime is not None else time.time()
+        event = 'data: %s\n\n' % json.dumps(status)
+        with self.condition:
+            self.sequence += 1
+            self.event = event
+            self.condition.notify_all()
+
+    def wait(self, sequence, timeout):
+        ''' Returns (sequence, event) of the first event newer than sequence
+or the old sequence after timeout seconds without a new event. '''
+        with self.condition:
+            if self.sequence == sequence: self.condition.wait(timeout)
+            return self.sequence, self.event
+
+broadcaster = PressureBroadcaster()
+mg_plugin.maxigauge.update_callbacks.append(broadcaster.publish)
+
+### The last 4 hours of readings at the fastest update rate of 0.4 s (more while polling slower):
+recent = SampleRingBuffer(36000)
+if snapshot: mg_plugin.maxigauge.backfill(recent.append)
+mg_plugin.maxigauge.update_callbacks.append(recent.append)
+
+### Reading the parameters takes extra round-trips, so only after the new readings went out:
+if mg_plugin.config is not None: mg_plugin.maxigauge.update_callbacks.append(mg_plugin.config.poll)
+
+@api.route('/recent')
+def recent_pressures():
+    ''' The readings in [start, stop) resampled to step (all in seconds) from memory.
+Defaults to the last hour in steps of 10 s. '''
+    now = time.time()
+    try:
+        stop = float(request.query.stop) if request.query.stop else now
+        start = float(request.query.start) if request.query.start else stop - 3600
+        step = float(request.query.step) if request.query.step else 10.
+    except ValueError:
+        raise HTTPError(400, "start, stop and step have to be numbers (seconds)")
+    if step <= 0 or (stop - start) / step > 100000: raise HTTPError(400, "Invalid step")
+    times, values = recent.window(start, stop, step)
+    data = { 'time': times }
+    for i in range(6):
+        data['gauge %d' % (i+1)] = values[i]
+    return data
+
+@api.route('/pressures_stream')
+def pressures_stream():
+    ''' Server-sent events with the pressures of every update (the data of /api/pressures plus their time) '''
+    response.content_type = 'text/event-stream'
+    response.set_header('Cache-Control', 'no-cache')
+    def stream():
+        yield 'retry: 2000\n\n'
+        sequence = broadcaster.sequence
+        if broadcaster.event: sequence -= 1 # start with the latest sample
+        while True:
+            new_sequence, event = broadcaster.wait(sequence, 15)
+            if new_sequence == sequence:
+                yield ': keep-alive\n\n' # also notices closed connections
+                continue
+            sequence = new_sequence
+            yield event
+    return stream()
+
 #@api.route('/cached_pressure_history_csv')
 #def cached_pressure_history_csv(maxigauge):
 #    try:
@@ -154,22 +284,111 @@ def pressure_data(maxigauge):
 #    for row in data:
 #        output.append("%d%s" % (row[0], "".join([", %.3E" % val for val in row[1:]] )))
 
-from os.path import getsize
+def query_time(value):
+    ''' Time query parameters are Unix time stamps or,
+if negative, seconds before now (e.g. start=-21600 for the last 6 hours) '''
+    if not value: return None
+    try:
+        value = float(value)
+    except ValueError:
+        raise HTTPError(400, "Invalid time: %s" % value)
+    return int(time.time() + value) if value < 0 else int(value)
+
+import os
+import zlib
+import itertools
+import email.utils
+from collections import OrderedDict
+from MeasurementLog import text_log_range, text_log_titles, text_log_bytes, aggregate_text_log, segments_in_range, segment_lines, log_segments, open_segment, line_time, AGGREGATES, ROLLUP_TIERS
+
+def gzip_stream(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) # wbits 31: with gzip header
+    for chunk in chunks:
+        if not isinstance(chunk, bytes): chunk = chunk.encode('latin-1')
+        data = compressor.compress(chunk)
+        if data: yield data
+    yield compressor.flush()
+
+### Compressed responses for time ranges that cannot change any more, least recently used first
+range_cache = OrderedDict()
+range_cache_lock = threading.Lock()
+RANGE_CACHE_BYTES = 64 << 20
+
+def send_history(produce, key=None):
+    ''' Sends the lines returned by produce() with ETag / Last-Modified validation
+and gzip compression (if the client accepts it). The ETag follows the write position
+of the log, except for immutable responses (with a `key` identifying the resolved
+range), which are kept compressed in memory. '''
+    try:
+        stat = os.stat(logfilename)
+    except OSError:
+        # e.g. right after the log was rotated or before anything was logged
+        raise HTTPError(404, "The measurement log %s does not exist" % logfilename)
+    immutable = key is not None
+    if immutable:
+        etag = '"r%x"' % (zlib.crc32(repr(key).encode('latin-1')) & 0xffffffff)
+        response.set_header('Cache-Control', 'max-age=86400')
+    else:
+        etag = '"%x-%x"' % (stat.st_ino, stat.st_size)
+        response.set_header('Last-Modified', email.utils.formatdate(stat.st_mtime, usegmt=True))
+    response.set_header('ETag', etag)
+    response.set_header('Vary', 'Accept-Encoding')
+    if 'If-None-Match' in request.headers:
+        # If-Modified-Since only counts without If-None-Match (RFC 7232, 3.3)
+        if etag in request.headers['If-None-Match']:
+            response.status = 304
+            return ''
+        since = None
+    else:
+        since = request.headers.get('If-Modified-Since')
+    if not immutable and since and email.utils.parsedate_tz(since) and email.utils.mktime_tz(email.utils.parsedate_tz(since)) >= int(stat.st_mtime):
+        response.status = 304
+        return ''
+    gzip = 'gzip' in request.headers.get('Accept-Encoding', '')
+    if gzip: response.set_header('Content-Encoding', 'gzip')
+    if not immutable:
+        return gzip_stream(produce()) if gzip else produce()
+    with range_cache_lock:
+        body = range_cache.pop(key, None)
+        if body is not None: range_cache[key] = body
+    if body is None:
+        body = b''.join(gzip_stream(produce()))
+        with range_cache_lock:
+            range_cache[key] = body
+            while sum(len(cached) for cached in range_cache.values()) > RANGE_CACHE_BYTES:
+                range_cache.popitem(last=False)
+    return body if gzip else zlib.decompress(body, 31)
+
 @api.route('/pressure_history_csv')
 def pressure_history_csv(maxigauge):
     maxigauge.flush_logfile()
+    start, end = query_time(request.query.start), query_time(request.query.end)
     try:
         number_of_lines = int(request.query.lines)
     except:
-        return static_file(logfilename, root='./', mimetype='text/csv', download=('pressure_history_%s.csv' % datetime.date.today().isoformat()) )
-    bytes = getsize(logfilename)
-    approximate_number_of_lines = (bytes - 33) / 60
-    print_every = approximate_number_of_lines / (number_of_lines - 1)
+        number_of_lines = None
+    if start is None and end is None and number_of_lines is None:
+        response.content_type = 'text/csv'
+        response.set_header('Content-Disposition', 'attachment; filename="pressure_history_%s.csv"' % datetime.date.today().isoformat())
+        return send_history(lambda: text_log_bytes(logfilename))
     #response.content_type = 'text/csv'
     response.content_type = 'text/plain'
-    request.query.fast
-    import subprocess
-    return subprocess.check_output(['./extract_every_nth_line', 'measurement-data.txt', str(print_every)])
+    ### aggregate=minmax preserves the peaks: every bucket gives a line with the minima and one with the maxima
+    aggregate = request.query.aggregate
+    if aggregate and aggregate not in AGGREGATES: raise HTTPError(400, "aggregate must be one of %s" % ", ".join(AGGREGATES))
+    ### Ranges given in absolute time ending before the last (rollup) bucket that may still change are immutable,
+    ### relative ones (e.g. start=-86400) move on with the time:
+    absolute = not any(value.strip().startswith('-') for value in (request.query.start, request.query.end))
+    cache_key = (start, end, number_of_lines, aggregate) if absolute and end is not None and end <= time.time() - max(ROLLUP_TIERS) else None
+    if number_of_lines is None:
+        return send_history(lambda: text_log_range(logfilename, start, end), cache_key)
+    ### Answer from the coarsest rollup tier with enough resolution, the raw log is the fallback:
+    lines = maxigauge.rollups.query(start, end, number_of_lines, aggregate or 'mean') if maxigauge.rollups else None
+    if lines is None and aggregate:
+        return send_history(lambda: itertools.chain(text_log_titles(logfilename), aggregate_text_log(logfilename, start, end, number_of_lines, aggregate)), cache_key)
+    if lines is None:
+        return send_history(lambda: text_log_range(logfilename, start, end, number_of_lines), cache_key)
+    return send_history(lambda: lines, cache_key)
     #try:
     #    request.query.fast
     #    import subprocess
@@ -184,40 +403,146 @@ def pressure_history_csv(maxigauge):
     #    i += 1
     #return output
 
-retdata = []
+class HistorySeries(object):
+    ''' Rickshaw series of every nth row of the text log '''
+    def __init__(self, fieldnames, every=1):
+        self.fieldnames = fieldnames
+        self.every = every
+        self.count = 0
+        self.cols = []
+        i = 0
+        for fieldname in fieldnames:
+            if fieldname.strip() != "" and fieldname != 'Seconds':
+                self.cols.append(i)
+            i += 1
+        self.series = []
+        for n in self.cols:
+                color = 'lightblue' if n%2 == 0 else 'steelblue'
+                self.series.append({ 'name': fieldnames[n], 'data': [], 'color': color })
+
+    def append(self, row):
+        if len(row) != len(self.fieldnames): return
+        self.count += 1
+        if (self.count-1)%self.every != 0: return
+        for k,j in enumerate(self.cols):
+            self.series[k]['data'].append({'x': int(row[0]), 'y': 0.0 if row[j].strip() == '' else float(row[j])})
+
+def history_series(lines, every=1):
+    ''' Converts lines of the text log (the 1st one holding the column titles)
+into Rickshaw series, using every nth line '''
+    import csv
+    log = csv.reader(lines)
+    # Get the 1st line, assuming it contains the column titles
+    history = HistorySeries(next(log), every)
+    for row in log:
+        history.append(row)
+    return history.series
+
+class HistoryCache(object):
+    ''' Keeps the JSON of the Rickshaw series of every nth line of the text log
+up to date. Every update() only reads the lines appended since the last one.
+After a rotation it finishes the renamed segment from where it was and
+goes on with the new log. If the log shrinks or is replaced otherwise, the
+cache starts over, reading the closed segments of a rotated log first. '''
+    def __init__(self, filename, every=100):
+        self.filename = filename
+        self.every = every
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self, inode=None):
+        self.inode = inode
+        self.offset = 0
+        self.live_start = None # time of the first line of the live log
+        self.history = None
+        self.body = json.dumps([])
+        # the closed segments of a rotated log come first
+        for segment in segments_in_range(self.filename):
+            if segment == self.filename: continue
+            if self.history is None:
+                titles = text_log_titles(self.filename)
+                if not titles: return
+                self.history = HistorySeries(titles[0].decode('latin-1').rstrip('\r\n').split(','), self.every)
+            for line in segment_lines(segment):
+                self.add_line(line)
+
+    def add_line(self, line):
+        row = line.decode('latin-1').rstrip('\r\n').split(',')
+        # Get the 1st line, assuming it contains the column titles
+        if self.history is None: self.history = HistorySeries(row, self.every)
+        elif line_time(line) is not None: self.history.append(row)
+
+    def follow_rotation(self, inode):
+        ''' Reads the rest of the live log renamed by a rotation (and of any segments closed after it)
+and starts reading the new live log. Returns False if the log was replaced in another way. '''
+        if self.history is None or self.live_start is None: return False
+        closed = [(start, segment) for start, segment in log_segments(self.filename)
+                  if segment != self.filename and start >= int(self.live_start)]
+        if not closed or closed[0][0] != int(self.live_start): return False
+        with open_segment(closed[0][1]) as f:
+            f.seek(self.offset) # a compressed segment is decompressed up to there once
+            for line in f:
+                self.add_line(line)
+        for start, segment in closed[1:]:
+            for line in segment_lines(segment):
+                self.add_line(line)
+        self.inode = inode
+        self.offset = 0
+        self.live_start = None
+        return True
+
+    def update(self):
+        with self.lock:
+            try:
+                stat = os.stat(self.filename)
+            except OSError:
+                return self.body
+            if stat.st_ino != self.inode and self.follow_rotation(stat.st_ino):
+                pass
+            elif stat.st_ino != self.inode or stat.st_size < self.offset:
+                self.reset(stat.st_ino)
+            if stat.st_size == self.offset:
+                return self.body
+            with open(self.filename, 'rb') as f:
+                f.seek(self.offset)
+                for line in f:
+                    if not line.endswith(b'\n'): break # the logger is still writing this line
+                    self.offset += len(line)
+                    if self.live_start is None: self.live_start = line_time(line)
+                    self.add_line(line)
+            if self.history is not None: self.body = json.dumps(self.history.series)
+            return self.body
+
+    def start(self, interval):
+        ''' Update the cache in the background every interval seconds '''
+        def tick():
+            while True:
+                self.update()
+                time.sleep(interval)
+        t = threading.Thread(target=tick)
+        t.daemon = True
+        t.start()
+
+history_cache = HistoryCache(logfilename)
+history_cache.start(30)
 @api.route('/pressure_history')
 def pressure_history(maxigauge):
-    global retdata
     response.content_type = 'application/json'
-    if len(retdata)>0: return json.dumps(retdata)
+    aggregate = request.query.aggregate
+    if aggregate:
+        ### e.g. ?aggregate=minmax&points=1000 to keep the pressure bursts visible
+        if aggregate not in AGGREGATES: raise HTTPError(400, "aggregate must be one of %s" % ", ".join(AGGREGATES))
+        try:
+            points = int(request.query.points)
+        except:
+            points = 1000
+        maxigauge.flush_logfile()
+        lines = maxigauge.rollups.query(None, None, points, aggregate) if maxigauge.rollups else None
+        if lines is None:
+            lines = itertools.chain(text_log_titles(logfilename), aggregate_text_log(logfilename, None, None, points, aggregate))
+        return json.dumps(history_series(lines))
     maxigauge.flush_logfile()
-    f = open( logfilename, 'r' )
-    import csv
-    log = csv.reader(f)
-
-    # Get the 1st line, assuming it contains the column titles
-    fieldnames = log.next()
-    
-    cols = []
-    i = 0
-    for fieldname in fieldnames:
-        if fieldname.strip() != "" and fieldname != 'Seconds':
-            cols.append(i)
-        i += 1
-    
-    retdata = []
-    for n in cols:
-            color = 'lightblue' if n%2 == 0 else 'steelblue'
-            retdata.append({ 'name': fieldnames[n], 'data': [], 'color': color })
-    
-    i = 0
-    for row in log:
-        if len(row) != len(fieldnames): continue
-        i = i + 1
-        if i%100 != 1: continue
-        for k,j in enumerate(cols):
-            retdata[k]['data'].append({'x': int(row[0]), 'y': 0.0 if row[j].strip() == '' else float(row[j])})
-    return json.dumps(retdata)
+    return history_cache.update()
 
 #@api.route('/pressures')
 #def pressures(maxigauge):
@@ -269,12 +594,13 @@ def history():
 def index():
     return static('index.html')
 
-print "Press Ctrl-C twice to stop this web server!"
+if __name__ == '__main__':
+    print "Press Ctrl-C twice to stop this web server!"
 
-## Run with cherrypy server via IPv4:
-run( root, server='cherrypy', host="0.0.0.0", port=8080)
-## Run with cherrypy server via IPv6:
-#run( root, server='cherrypy', host="::", port=8080)
+    ## Run with cherrypy server via IPv4 (every open live page keeps one of the threads busy):
+    run( root, server='cherrypy', host="0.0.0.0", port=8080, numthreads=50)
+    ## Run with cherrypy server via IPv6:
+    #run( root, server='cherrypy', host="::", port=8080)
 
 ## Run with bottle's standard server (IPv4):
 #run( root, host="localhost", port=8080)